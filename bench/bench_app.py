@@ -0,0 +1,380 @@
+"""Benchmarks of the hot paths of the web UI, as the data grows.
+
+The app is exercised with Flask's test client, in a scratch folder filled
+with synthetic runs, run logs and input files, and with a fake dispatcher,
+so no co2mpas model is ever built nor run.  The latency and peak memory of
+each endpoint, and the time to import and start the app cold, are reported,
+and compared with a baseline stored on the same machine::
+
+    python bench/bench_app.py --save        # store the baseline
+    python bench/bench_app.py               # fail on regressions
+
+Timings only compare on the same machine, so the baseline is not versioned
+(see ``.gitignore``): it records the commit, host and Python it was stored
+with, reported by every comparison.
+
+Generating the fixtures takes a while at full size; they are kept in the
+``--folder`` given, and reused while their sizes do not change.
+"""
+
+import argparse
+import json
+import logging
+import os
+import os.path as osp
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from co2wui import app as webapp  # noqa: E402
+from co2wui import jobs, runlog, simulation, store  # noqa: E402
+
+#: Sizes of the fixtures, in full and with ``--quick``.
+SIZES = {"runs": 10000, "log_mb": 500, "inputs": 1000}
+QUICK_SIZES = {"runs": 500, "log_mb": 20, "inputs": 100}
+
+#: The run holding the large log, and the prefix of the other runs made.
+LOG_RUN = "bench-log"
+RUN_PREFIX = "20190101-000000-"
+
+FIXTURES = "fixtures.json"
+
+BASELINE = osp.join(osp.dirname(osp.abspath(__file__)), "baseline.json")
+
+
+class FakeDispatcher(object):
+    """Stands for the co2mpas dispatcher, writing placeholder files only."""
+
+    nodes = {}
+
+    def dispatch(self, inputs, outputs):
+        if "template" in outputs:
+            with open(inputs["output_file"], "wb") as f:
+                f.write(b"template")
+        else:
+            folder = inputs["cmd_flags"]["output_folder"]
+            for fpath in inputs["input_files"]:
+                name = osp.splitext(osp.basename(fpath))[0]
+                with open(osp.join(folder, name + "-output.xlsx"), "wb") as f:
+                    f.write(b"output")
+        return {"done": True}
+
+
+def _make_runs(n):
+    rnd = random.Random(0)
+    job_store = store.JobStore("output/jobs.db")
+    start = time.time() - 365 * 86400
+    for i in range(n):
+        run_id = "%s%06d" % (RUN_PREFIX, i)
+        folder = osp.join("output", run_id)
+        os.makedirs(folder)
+        for name in ("input-%d-output.xlsx" % i, "20190101-summary.xlsx"):
+            with open(osp.join(folder, name), "wb") as f:
+                f.write(os.urandom(rnd.randint(1 << 10, 64 << 10)))
+
+        job = jobs.Job(run_id, {"log_level": "INFO"})
+        for flag in simulation.FLAGS:
+            if rnd.random() < 0.3:
+                job.flags[flag] = "on"
+        job.state = jobs.FAILED if rnd.random() < 0.1 else jobs.FINISHED
+        job.submitted = start + i * 365 * 86400 / n
+        job.started = job.submitted + rnd.random() * 10
+        job.finished = job.started + rnd.random() * 300
+        job_store.add(job)
+        job_store.index_run(run_id, folder, os.listdir(folder))
+
+
+def _make_log(size):
+    # A block of records of all levels, repeated up to the size
+    folder = osp.join("output", LOG_RUN)
+    os.makedirs(folder)
+    levels = [logging.DEBUG] * 6 + [logging.INFO] * 3 + [logging.WARNING]
+    records = []
+    for i in range(1000):
+        level = levels[i % len(levels)] if i % 250 else logging.ERROR
+        record = logging.makeLogRecord(
+            {
+                "name": "co2mpas.model.physical",
+                "levelno": level,
+                "levelname": logging.getLevelName(level),
+                "msg": "Calibrating node %d of the model with %s.",
+                "args": (i, "x" * (i % 80)),
+                "created": 1546300800 + i,
+                "stage": "simulation",
+            }
+        )
+        records.append((runlog.to_json(record).encode("utf-8"), level))
+
+    offset = 0
+    with open(osp.join(folder, runlog.LOGFILE), "wb") as log:
+        with open(osp.join(folder, runlog.INDEX), "wb") as index:
+            while offset < size:
+                lines, entries = [], []
+                for line, level in records:
+                    entries.append(runlog.ENTRY.pack(offset, level))
+                    lines.append(line)
+                    offset += len(line)
+                log.write(b"".join(lines))
+                index.write(b"".join(entries))
+
+
+def _make_inputs(n):
+    os.makedirs("input")
+    for i in range(n):
+        with open(osp.join("input", "bench-%04d.xlsx" % i), "wb") as f:
+            f.write(os.urandom(16 << 10))
+
+
+def make_fixtures(sizes):
+    """Fill the current folder with the runs, log and inputs of `sizes`."""
+    if osp.isfile(FIXTURES):
+        with open(FIXTURES) as f:
+            if json.load(f) == sizes:
+                return False
+        raise SystemExit(
+            "Fixtures of other sizes in %r, use another folder." % os.getcwd()
+        )
+    _make_runs(sizes["runs"])
+    _make_log(sizes["log_mb"] << 20)
+    _make_inputs(sizes["inputs"])
+    with open(FIXTURES, "w") as f:
+        json.dump(sizes, f)
+    return True
+
+
+def endpoints(app, sizes):
+    """The ``(name, url, headers)`` of the requests measured."""
+    job_store = store.JobStore(app.config["CO2WUI_JOBS_DB"])
+    last = sizes["runs"] - 1
+    run_id = "%s%06d" % (RUN_PREFIX, last)
+    file_id = job_store.get_files([run_id])[run_id][0][0]
+    last_page = sizes["runs"] // app.config["CO2WUI_RESULTS_PER_PAGE"]
+    return [
+        ("simulation_form", "/run/simulation-form", {}),
+        ("view_results", "/run/view-results", {}),
+        ("view_results_last_page", "/run/view-results?page=%d" % last_page, {}),
+        (
+            "view_results_filtered",
+            "/run/view-results?sort=name&state=failed&tamode=on",
+            {},
+        ),
+        ("view_results_json", "/run/view-results?format=json", {}),
+        ("run_progress", "/run/progress?layout=layout&id=" + LOG_RUN, {}),
+        ("run_progress_json", "/run/progress?format=json&id=" + LOG_RUN, {}),
+        ("log_tail", "/run/log-tail?id=%s&offset=0" % LOG_RUN, {}),
+        ("download_result", "/run/download-result/%s/%d" % (run_id, file_id), {}),
+        (
+            "download_result_range",
+            "/run/download-result/%s/%d" % (run_id, file_id),
+            {"Range": "bytes=0-1023"},
+        ),
+        ("download_log_errors", "/run/download-log/%s?level=ERROR" % LOG_RUN, {}),
+        ("download_template", "/run/download-template", {}),
+        # Last, as each one adds a run, of all the inputs, see remove_runs()
+        ("submit_run", "/run/simulation?log_level=INFO", {}),
+    ]
+
+
+def _request(client, url, headers):
+    rv = client.get(url, headers=headers)
+    try:
+        # Streamed bodies are produced only while read
+        rv.get_data()
+        if rv.status_code not in (200, 206, 302):
+            raise SystemExit("%s answered %s" % (url, rv.status))
+    finally:
+        rv.close()
+
+
+def measure(client, url, headers, repeat):
+    """The median and 95th percentile seconds, and the peak KiB, of `url`."""
+    _request(client, url, headers)  # warm up
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        _request(client, url, headers)
+        times.append(time.perf_counter() - t)
+    times.sort()
+
+    # Traced apart, as tracing slows everything down
+    tracemalloc.start()
+    try:
+        _request(client, url, headers)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "median": statistics.median(times),
+        "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+        "peak_kb": peak >> 10,
+    }
+
+
+def cold_start(repeat):
+    """The seconds to import the app in a new interpreter, as `co2wui` does."""
+    code = "import time; t = time.perf_counter(); import co2wui.app; "
+    code += "print(time.perf_counter() - t)"
+    times = [
+        float(subprocess.check_output([sys.executable, "-c", code], cwd=ROOT))
+        for _ in range(repeat)
+    ]
+    return {"median": statistics.median(times), "p95": max(times), "peak_kb": 0}
+
+
+def remove_runs(app):
+    """Remove the runs submitted while measuring, leaving the fixtures as made."""
+    app.extensions["co2wui.executor"].shutdown(wait=False)
+    submitted = [
+        name
+        for name in os.listdir("output")
+        if osp.isdir(osp.join("output", name))
+        and name != LOG_RUN
+        and not name.startswith(RUN_PREFIX)
+    ]
+    store.JobStore(app.config["CO2WUI_JOBS_DB"]).delete(submitted)
+    for run_id in submitted:
+        shutil.rmtree(osp.join("output", run_id), ignore_errors=True)
+
+
+def source():
+    """What the results are of: the commit, the host and the Python measured."""
+    try:
+        commit = subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def compare(results, baseline, tolerance, floor=0.005):
+    """The regressions of `results` beyond `tolerance` of the `baseline`.
+
+    Latencies within `floor` seconds of the baseline are taken as noise.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slower = result["median"] - base["median"]
+        if slower > floor and result["median"] > base["median"] * (1 + tolerance):
+            regressions.append(
+                "%s: %.1f ms, was %.1f ms"
+                % (name, result["median"] * 1e3, base["median"] * 1e3)
+            )
+        if result["peak_kb"] > base["peak_kb"] * (1 + tolerance) + 64:
+            regressions.append(
+                "%s: %d KiB peak, was %d KiB"
+                % (name, result["peak_kb"], base["peak_kb"])
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--folder", help="where the fixtures are (kept) [temporary]")
+    parser.add_argument("--quick", action="store_true", help="small fixtures")
+    parser.add_argument("--repeat", type=int, default=10, help="requests timed")
+    parser.add_argument("--baseline", default=BASELINE, help="the stored results")
+    parser.add_argument("--save", action="store_true", help="store as baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="slowdown allowed [0.25]"
+    )
+    opts = parser.parse_args(argv)
+
+    sizes = dict(QUICK_SIZES if opts.quick else SIZES)
+    baseline_path = osp.abspath(opts.baseline)
+    folder = opts.folder or tempfile.mkdtemp(prefix="co2wui-bench-")
+    os.makedirs(folder, exist_ok=True)
+    os.chdir(folder)
+
+    t = time.perf_counter()
+    if make_fixtures(sizes):
+        print("Fixtures made in %s in %.1f s" % (folder, time.perf_counter() - t))
+
+    # Never builds the co2mpas model, nor sweeps in the background; the runs
+    # submitted only write placeholders, queued without bounds
+    simulation._dispatcher = FakeDispatcher()
+    simulation.version = lambda: "bench"
+    with open("bench.cfg", "w") as f:
+        f.write("CO2WUI_WORKERS = 1\nCO2WUI_PRELOAD = False\n")
+        f.write("CO2WUI_QUEUE_SIZE = None\nCO2WUI_RESULT_CACHE_SIZE = 0\n")
+        f.write("CO2WUI_RETENTION_INTERVAL = 0\n")
+    results = {"import": cold_start(3)}
+    print("Imported in %.1f ms" % (results["import"]["median"] * 1e3))
+    t = time.perf_counter()
+    app = webapp.create_app(osp.abspath("bench.cfg"))
+    app.extensions["co2wui.start_up"]()
+    results["startup"] = {"median": time.perf_counter() - t, "p95": 0, "peak_kb": 0}
+    print("Started in %.1f ms" % (results["startup"]["median"] * 1e3))
+    client = app.test_client()
+
+    print("%-24s %10s %10s %10s" % ("endpoint", "median ms", "p95 ms", "peak KiB"))
+    try:
+        for name, url, headers in endpoints(app, sizes):
+            results[name] = result = measure(client, url, headers, opts.repeat)
+            print(
+                "%-24s %10.1f %10.1f %10d"
+                % (name, result["median"] * 1e3, result["p95"] * 1e3, result["peak_kb"])
+            )
+    finally:
+        remove_runs(app)
+
+    measured = source()
+    if opts.save:
+        with open(baseline_path, "w") as f:
+            json.dump(
+                {"sizes": sizes, "results": results, "source": measured},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        print("Baseline stored in %s" % baseline_path)
+        return 0
+    if not osp.isfile(baseline_path):
+        print("No baseline in %s, store one with --save" % baseline_path)
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    stored = baseline.get("source") or {}
+    print(
+        "Compared with %s: %s on %s, Python %s, stored %s"
+        % (
+            baseline_path,
+            stored.get("commit") or "unknown commit",
+            stored.get("host") or "unknown host",
+            stored.get("python") or "?",
+            stored.get("saved") or "?",
+        )
+    )
+    if stored.get("host") != measured["host"]:
+        print("The baseline is of another machine, its timings may not compare")
+    if baseline["sizes"] != sizes:
+        print("The baseline is of fixtures of other sizes: %s" % baseline["sizes"])
+        return 2
+    regressions = compare(results, baseline["results"], opts.tolerance)
+    for regression in regressions:
+        print("REGRESSION %s" % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
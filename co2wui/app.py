@@ -3,28 +3,29 @@ import glob
 from stat import S_ISREG, S_ISDIR, ST_CTIME, ST_MODE
 from os import path
 import webbrowser
+import atexit
 import threading
-import tempfile
-import schedula as sh
 #import co2mpas_dice
-from co2mpas import dsp as dsp
-from co2mpas import __version__
 import click
 from flask import Flask, render_template, current_app, url_for, request, send_file
-from flask import Response
-from flask import Flask, redirect
+from flask import Response, stream_with_context
+from flask import Flask, redirect, jsonify, abort, g
 from flask.cli import FlaskGroup
 from os import listdir
 from os.path import isfile, join
-import requests
 import json
 import io
+import queue
 import os
 import time
 import os.path as osp
 from werkzeug import secure_filename
 import logging
 import logging.config
+import jinja2
+import mimetypes
+from co2wui import batch, cache, export, feeds, jobs, logtail, runlog, simulation
+from co2wui import assets, fragments, metrics, retention, store, timings, uploads
 
 
 def listdir_inputs(path):
@@ -39,15 +40,280 @@ def listdir_outputs(path):
     return map(lambda x: os.path.basename(x), glob.glob(os.path.join(path, "*.xls*")))
 
 
+#: The columns of the results page, by the sort key in its query.
+RESULT_SORTS = {"date": "submitted", "name": "id", "state": "state"}
+
+RESULT_STATES = (jobs.FINISHED, jobs.FAILED)
+
+
+def _timestamp(date, days=0):
+    """The epoch of a ``YYYY-MM-DD`` `date` (plus `days`), or ``None``."""
+    try:
+        t = time.strptime(date or "", "%Y-%m-%d")
+    except ValueError:
+        return None
+    return time.mktime(t) + days * 86400
+
+
+def _read_log(folder, offset=0, level=logtail.SHOWN, limit=1 << 20):
+    """The text lines of the records of a run log indexed after `offset`."""
+    records, offset = logtail.read_records(folder, offset, level, limit)
+    return [logtail.format_record(r) for r in records], offset
+
+
+def _last_log(folder, n):
+    """The last `n` text lines shown of a run log, and their offset."""
+    legacy = osp.join(folder, "logfile.txt")
+    if not osp.isfile(osp.join(folder, runlog.INDEX)) and osp.isfile(legacy):
+        return logtail.last_lines(legacy, n)
+    records, offset = logtail.last_records(folder, n)
+    return [logtail.format_record(r) for r in records], offset
+
+
 def create_app(configfile=None):
 
     log_file_path = path.join(path.dirname(path.abspath(__file__)), "../logging.conf")
-    logging.config.fileConfig(log_file_path)
+    logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
     log = logging.getLogger(__name__)
 
-    app = Flask(__name__)
+    # Static files are served from the bundles built below only
+    app = Flask(__name__, static_folder=None)
+    app.config.from_mapping(
+        CO2WUI_WORKERS=os.cpu_count(),
+        CO2WUI_QUEUE_SIZE=32,
+        CO2WUI_PRELOAD=True,
+        CO2WUI_MAX_JOBS_PER_WORKER=20,
+        CO2WUI_PRIORITIES={"tamode": 10},
+        CO2WUI_RUN_TIMEOUT=0,
+        CO2WUI_CACHE_FOLDER="cache",
+        CO2WUI_LOG_LINES=500,
+        CO2WUI_FEED_INTERVAL=0.5,
+        CO2WUI_JOBS_DB="output/jobs.db",
+        CO2WUI_RESULTS_PER_PAGE=50,
+        CO2WUI_RESULT_CACHE_SIZE=1 << 30,
+        CO2WUI_MAX_UPLOAD_SIZE=64 << 20,
+        CO2WUI_UPLOAD_MAX_AGE=1,
+        CO2WUI_LOG_LEVEL="INFO",
+        CO2WUI_OUTPUT_QUOTA=0,
+        CO2WUI_OUTPUT_MAX_AGE=0,
+        CO2WUI_COMPRESS_AFTER=7,
+        CO2WUI_RETENTION_INTERVAL=3600,
+    )
+    if configfile:
+        app.config.from_pyfile(configfile)
     CO2MPAS_VERSION = "3"
 
+    # The runs of all sessions, opened once starting up, see start_up()
+    job_store = store.JobStore(app.config["CO2WUI_JOBS_DB"])
+
+    # Metrics of the service, updated as things happen, by web worker
+    registry = metrics.Registry({"worker": os.getpid})
+    app.extensions["co2wui.metrics"] = registry
+    runs_submitted = registry.counter(
+        "co2wui_runs_submitted_total", "Simulations submitted, by mode.", ["mode"]
+    )
+    runs_rejected = registry.counter(
+        "co2wui_runs_rejected_total", "Simulations rejected, with the queue full."
+    )
+    runs_stopped = registry.counter(
+        "co2wui_runs_stopped_total",
+        "Simulations cancelled or timed out, by reason.",
+        ["reason"],
+    )
+    runs_completed = registry.counter(
+        "co2wui_runs_completed_total", "Simulations over, by state.", ["state"]
+    )
+    run_duration = registry.histogram(
+        "co2wui_run_duration_seconds",
+        "Time taken by the simulations, by state.",
+        ["state"],
+        metrics.RUN_BUCKETS,
+    )
+    run_wait = registry.histogram(
+        "co2wui_run_wait_seconds",
+        "Time the simulations waited for a worker.",
+        buckets=metrics.RUN_BUCKETS,
+    )
+    requests_total = registry.counter(
+        "co2wui_requests_total",
+        "HTTP requests, by route and status.",
+        ["route", "status"],
+    )
+    request_duration = registry.histogram(
+        "co2wui_request_duration_seconds",
+        "Time to answer the HTTP requests, by route.",
+        ["route"],
+    )
+    downloads = registry.counter(
+        "co2wui_downloads_total", "Files downloaded, by kind.", ["kind"]
+    )
+    event_streams = registry.gauge(
+        "co2wui_event_streams", "Browsers following the progress of a run."
+    )
+    # Also refreshed as other web workers add and remove runs, on each sweep
+    results_bytes = registry.gauge(
+        "co2wui_results_bytes", "Size of the result files cataloged under output."
+    )
+    output_bytes = registry.gauge(
+        "co2wui_output_bytes", "Size of the runs under output, as of the last check."
+    )
+
+    def refresh_usage(usage=None):
+        results_bytes.set(job_store.results_size())
+        output_bytes.set((usage or output_retention.usage())["bytes"])
+
+    runs_deleted = registry.counter(
+        "co2wui_runs_deleted_total", "Runs removed, with their results."
+    )
+
+    def index_results(job):
+        folder = "output/" + job.id
+        job_store.index_run(job.id, folder, list(listdir_outputs(folder)))
+        refresh_usage()
+        runs_completed.inc(state=job.state)
+        if job.error == jobs.CANCELLED:
+            runs_stopped.inc(reason="cancelled")
+        elif job.error and job.error.startswith("Timed out"):
+            runs_stopped.inc(reason="timeout")
+        run_duration.observe(job.finished - job.started, state=job.state)
+        run_wait.observe(job.started - job.submitted)
+
+    # Simulations run in a pool of worker processes, forked on the first run
+    # after building the dispatcher, so they start warm; it is built in the
+    # background once serving, pages not simulating anything being answered
+    warming = []
+
+    @app.before_first_request
+    def start_warm_up():
+        if app.config["CO2WUI_PRELOAD"]:
+            warming.append(simulation.warm_up(background=True))
+
+    def wait_warm_up():
+        for thread in warming:
+            thread.join()
+
+    def run_priority(flags):
+        # The highest of the flags set, e.g. type approval runs come first
+        priorities = app.config["CO2WUI_PRIORITIES"]
+        return max([priorities.get(f, 0) for f in flags if flags[f]], default=0)
+
+    executor = jobs.JobExecutor(
+        app.config["CO2WUI_WORKERS"],
+        app.config["CO2WUI_QUEUE_SIZE"],
+        initializer=simulation.init_worker,
+        max_tasks=app.config["CO2WUI_MAX_JOBS_PER_WORKER"],
+        store=job_store,
+        on_done=index_results,
+    )
+    atexit.register(executor.shutdown, wait=False)
+    app.extensions["co2wui.executor"] = executor
+    registry.gauge(
+        "co2wui_runs_queued",
+        "Simulations waiting for a worker.",
+        fn=lambda: executor.count(jobs.QUEUED),
+    )
+    registry.gauge(
+        "co2wui_runs_running",
+        "Simulations running.",
+        fn=lambda: executor.count(jobs.RUNNING),
+    )
+    registry.gauge(
+        "co2wui_workers", "Worker processes.", fn=lambda: app.config["CO2WUI_WORKERS"]
+    )
+    startup_seconds = registry.gauge(
+        "co2wui_startup_seconds", "Time taken by the startup, by phase.", ["phase"]
+    )
+    registry.gauge(
+        "co2wui_dispatcher_build_seconds",
+        "Time taken to build the co2mpas dispatcher, once built.",
+        fn=lambda: simulation.build_time or 0,
+    )
+
+    # Past runs are compressed, and removed when too old or too many; each
+    # web worker sweeps in turn, sharing the usage found through the store
+    output_retention = retention.Retention(
+        job_store,
+        "output",
+        app.config["CO2WUI_OUTPUT_QUOTA"],
+        app.config["CO2WUI_OUTPUT_MAX_AGE"] * 86400,
+        app.config["CO2WUI_COMPRESS_AFTER"] * 86400,
+        on_delete=lambda run_ids: runs_deleted.inc(len(run_ids)),
+        on_usage=refresh_usage,
+        on_sweep=lambda now: input_uploads.sweep(
+            app.config["CO2WUI_UPLOAD_MAX_AGE"] * 86400, now
+        ),
+    )
+
+    @app.before_request
+    def start_timer():
+        g.started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_duration.observe(time.perf_counter() - g.started, route=route)
+        requests_total.inc(route=route, status=response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def scrape_metrics():
+        return Response(
+            registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    # Bundles of the static assets, fingerprinted, cached by browsers for good
+    static_assets = assets.Assets(
+        osp.join(app.root_path, "static"),
+        osp.join(app.config["CO2WUI_CACHE_FOLDER"], "assets"),
+    )
+    app.add_template_global(static_assets.url, "asset_url")
+
+    # Templates are compiled once, across restarts too, and the parts common
+    # to the pages rendered once, by the section active
+    templates = osp.join(app.config["CO2WUI_CACHE_FOLDER"], "templates")
+    app.jinja_env.bytecode_cache = jinja2.FileSystemBytecodeCache(templates)
+    page_fragments = fragments.Fragments(app.jinja_env)
+    app.add_template_global(page_fragments.render, "fragment")
+
+    @app.route("/static/<path:filename>")
+    def static_file(filename):
+        found = static_assets.lookup(
+            filename, request.headers.get("Accept-Encoding", "")
+        )
+        if found is None:
+            abort(404)
+        fpath, encoding = found
+        rv = send_file(
+            osp.abspath(fpath),
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            conditional=True,
+        )
+        if encoding:
+            rv.headers["Content-Encoding"] = encoding
+        rv.vary.add("Accept-Encoding")
+        rv.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return rv
+
+    run_feeds = feeds.Feeds(app.config["CO2WUI_FEED_INTERVAL"])
+
+    content_cache = cache.ContentCache(app.config["CO2WUI_CACHE_FOLDER"])
+    template_lock = threading.Lock()
+
+    # Identical runs reuse the results of the previous ones
+    result_cache = None
+    if app.config["CO2WUI_RESULT_CACHE_SIZE"]:
+        result_cache = cache.ResultCache(
+            osp.join(app.config["CO2WUI_CACHE_FOLDER"], "results"),
+            app.config["CO2WUI_RESULT_CACHE_SIZE"],
+        )
+
+    # Input files are received in chunks, hashed while written
+    input_uploads = uploads.Uploads(
+        osp.join(app.config["CO2WUI_CACHE_FOLDER"], "uploads"),
+        "input",
+        app.config["CO2WUI_MAX_UPLOAD_SIZE"],
+    )
+
     @app.route("/")
     def index():
         return render_template(
@@ -73,32 +339,33 @@ def create_app(configfile=None):
     @app.route("/run/download-template")
     def download_template():
 
-        # Temp file name
-        of = next(tempfile._get_candidate_names())
-
-        # Input parameters
-        inputs = {"output_file": of, "template_type": "input"}
+        # Generated once per co2mpas version
+        key = "input-template-%s" % simulation.version()
+        digest = content_cache.lookup(key)
+        if digest is None:
+            with template_lock:
+                digest = content_cache.lookup(key)
+                if digest is None:
+                    of = content_cache.mkstemp(suffix=".xlsx")
 
-        # Dispatcher
-        d = dsp.register()
-        ret = d.dispatch(inputs, ["template", "done"])
+                    # Input parameters
+                    inputs = {"output_file": of, "template_type": "input"}
 
-        # Read from file
-        data = None
-        with open(of, "rb") as xlsx:
-            data = xlsx.read()
+                    # Dispatcher
+                    simulation.dispatcher().dispatch(inputs, ["template", "done"])
+                    digest = content_cache.put(of, key)
+        downloads.inc(kind="template")
 
-        # Delete files
-        os.remove(of)
-
-        # Output xls file
-        iofile = io.BytesIO(data)
-        iofile.seek(0)
-        return send_file(
-            iofile,
+        # Output xls file, revalidated by browsers with conditional requests
+        rv = send_file(
+            osp.abspath(content_cache.path(digest)),
             attachment_filename="co2mpas-input-template.xlsx",
             as_attachment=True,
+            add_etags=False,
+            cache_timeout=0,
         )
+        rv.set_etag(digest)
+        return rv.make_conditional(request)
 
     @app.route("/run/simulation-form")
     def simulation_form():
@@ -110,185 +377,464 @@ def create_app(configfile=None):
                 "breadcrumb": ["Co2mpas", "Run simulation"],
                 "props": {"active": {"run": "active", "doc": "", "expert": ""}},
                 "inputs": inputs,
+                "log_levels": runlog.LEVELS,
+                "log_level": app.config["CO2WUI_LOG_LEVEL"],
             },
         )
 
-    def run_process(args):
+    # Run
+    @app.route("/run/simulation")
+    def run_simulation():
 
-        thread = threading.current_thread()
+        run_id = jobs.new_run_id()
+        args = request.args.to_dict()
+        if args.get("log_level") not in runlog.LEVELS:
+            args["log_level"] = app.config["CO2WUI_LOG_LEVEL"]
         files = [
             "input/" + f for f in listdir_inputs("input") if isfile(join("input", f))
         ]
+        mode = "split" if args.get("split_inputs") else "single"
+        limits = {
+            "priority": run_priority(args),
+            "timeout": app.config["CO2WUI_RUN_TIMEOUT"] or None,
+        }
+        wait_warm_up()
+        try:
+            if args.get("split_inputs"):
+                # One parallel co2mpas run per input file
+                executor.submit_many(
+                    run_id,
+                    simulation.run_process,
+                    [(run_id, args, [f], i, result_cache) for i, f in enumerate(files)],
+                    finalize=(simulation.merge_parts, (run_id,)),
+                    flags=args,
+                    **limits
+                )
+            else:
+                executor.submit(
+                    run_id,
+                    simulation.run_process,
+                    run_id,
+                    args,
+                    files,
+                    None,
+                    result_cache,
+                    flags=args,
+                    **limits
+                )
+        except jobs.QueueFull:
+            runs_rejected.inc()
+            return (
+                render_template(
+                    "layout.html",
+                    action="generic_message",
+                    data={
+                        "breadcrumb": ["Co2mpas", "Simulation not started"],
+                        "props": {"active": {"run": "active", "doc": "", "expert": ""}},
+                        "title": "Too many simulations waiting",
+                        "message": "The server is busy, please retry in a few minutes.",
+                    },
+                ),
+                503,
+            )
+        runs_submitted.inc(mode=mode)
+        os.makedirs("output/" + run_id, exist_ok=True)
+        return redirect("/run/progress?layout=layout&id=" + run_id, code=302)
 
-        # Create output directory for this execution
-        output_folder = "output/" + str(thread.ident)
-        os.makedirs(output_folder or ".", exist_ok=True)
+    @app.route("/run/progress")
+    def run_progress():
 
-        # Dedicated logging for this run
-        fileh = logging.FileHandler(
-            "output/" + str(thread.ident) + "/" + "logfile.txt", "a"
-        )
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        fileh.setFormatter(formatter)
-        log = logging.getLogger()
-        log.setLevel(logging.DEBUG)
-        for hdlr in log.handlers[:]:
-            log.removeHandler(hdlr)
-        log.addHandler(fileh)
-
-        # Input parameters
-        kwargs = {
-            "output_folder": output_folder,
-            "only_summary": bool(args.get("only_summary")),
-            "hard_validation": bool(args.get("hard_validation")),
-            "declaration_mode": bool(args.get("declaration_mode")),
-            "encryption_keys": "",
-            "sign_key": "",
-            "encryption_keys_passwords": "",
-            "enable_selector": False,
-            "type_approval_mode": bool(args.get("tamode")),
+        run_id = request.args.get("id")
+        layout = request.args.get("layout")
+
+        # Runs unknown to the executor predate the job store
+        job = executor.get(run_id)
+        state = job.state if job else jobs.FINISHED
+
+        page = "run_complete" if job is None or job.done else "run_progress"
+        title = {
+            jobs.QUEUED: "Simulation queued...",
+            jobs.RUNNING: "Simulation in progress...",
+            jobs.FINISHED: "Simulation complete",
+            jobs.FAILED: "Simulation failed",
+        }[state]
+
+        # Only the last lines, the page then follows the new ones
+        folder = "output/" + secure_filename(run_id)
+        loglines, offset = _last_log(folder, app.config["CO2WUI_LOG_LINES"])
+        progress = {
+            "run_id": run_id,
+            "state": state,
+            "title": title,
+            "offset": offset,
+            "levels": logtail.level_counts(folder),
+            "profiled": isfile(osp.join(folder, timings.PROFILE)),
+            "priority": run_priority(job.flags) if job else 0,
+            "ahead": executor.ahead(run_id),
+            "timeout": app.config["CO2WUI_RUN_TIMEOUT"],
+            "error": job.error if job else None,
         }
+        if request.args.get("format") == "json":
+            return jsonify(dict(progress, lines=loglines))
 
-        inputs = dict(
-            plot_workflow=False,
-            host="127.0.0.1",
-            port=4999,
-            cmd_flags=kwargs,
-            input_files=files,
+        return render_template(
+            "layout.html" if layout == "layout" else "ajax.html",
+            action=page,
+            data=dict(
+                progress,
+                breadcrumb=["Co2mpas", title],
+                props={"active": {"run": "active", "doc": "", "expert": ""}},
+                log="".join(reversed(loglines)),
+            ),
         )
 
-        # Dispatcher
-        d = dsp.register()
-        ret = d.dispatch(inputs, ["done", "run"])
-        f = open("output/" + str(thread.ident) + "/result.dat", "w+")
-        f.write(str(ret))
-        return ""
-
-    # Run
-    @app.route("/run/simulation")
-    def run_simulation():
+    @app.route("/run/cancel/<runid>", methods=["POST"])
+    def cancel_run(runid):
+        run_id = secure_filename(runid)
+        if executor.cancel(run_id):
+            log.info("Run %s cancelled.", run_id)
+        return redirect("/run/progress?layout=layout&id=" + run_id, code=303)
 
-        thread = threading.Thread(target=run_process, args=(request.args,))
-        thread.daemon = False
-        thread.start()
-        id = thread.ident
-        return redirect("/run/progress?layout=layout&id=" + str(thread.ident), code=302)
+    @app.route("/run/log-tail")
+    def log_tail():
+        run_id = request.args.get("id")
+        offset = request.args.get("offset", 0, type=int)
 
-    @app.route("/run/progress")
-    def run_progress():
+        job = executor.get(run_id)
+        lines, offset = _read_log("output/" + secure_filename(run_id), offset)
+        return jsonify(
+            {
+                "lines": lines,
+                "offset": offset,
+                "state": job.state if job else jobs.FINISHED,
+            }
+        )
 
-        done = True
+    @app.route("/run/events")
+    def run_events():
+        run_id = request.args.get("id")
+        state = request.args.get("state")
+        offset = request.headers.get("Last-Event-ID", type=int)
+        if offset is None:
+            offset = request.args.get("offset", 0, type=int)
 
-        thread_id = request.args.get("id")
-        layout = request.args.get("layout")
+        folder = "output/" + secure_filename(run_id)
 
-        for thread in threading.enumerate():
-            if (thread.ident == int(thread_id)) and thread.is_alive():
-                done = False
+        def get_state():
+            job = executor.get(run_id)
+            return job.state if job else jobs.FINISHED
 
-        page = "run_complete" if done else "run_progress"
-        title = "Simulation complete" if done else "Simulation in progress..."
+        feed = run_feeds.get(run_id, folder, get_state)
 
-        log = ""
-        loglines = []
-        with open("output/" + thread_id + "/" + "logfile.txt") as f:
-            loglines = f.readlines()
+        def log_event(lines, end):
+            return "id: %d\nevent: log\ndata: %s\n\n" % (end, json.dumps(lines))
 
-        for logline in reversed(loglines):
-            if not re.search("- INFO -", logline):
-                log += logline
+        def stream(offset):
+            q, start, current = feed.subscribe()
+            event_streams.inc()
+            try:
+                # Catch up with the feed, then follow it
+                if offset < start:
+                    lines, offset = _read_log(folder, offset, limit=start - offset)
+                    yield log_event(lines, offset)
+                while current == state:
+                    try:
+                        event = q.get(timeout=15)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                        continue
+                    if event[0] == "state":
+                        current = event[1]
+                        continue
+                    _, start, end, lines = event
+                    if end <= offset:
+                        continue
+                    if start != offset:
+                        lines, end = _read_log(folder, offset, limit=end - offset)
+                    offset = end
+                    yield log_event(lines, offset)
+                yield "event: state\ndata: %s\n\n" % json.dumps(current)
+            finally:
+                event_streams.dec()
+                feed.unsubscribe(q)
 
-        return render_template(
-            "layout.html" if layout == "layout" else "ajax.html",
-            action=page,
-            data={
-                "breadcrumb": ["Co2mpas", title],
-                "props": {"active": {"run": "active", "doc": "", "expert": ""}},
-                "thread_id": thread_id,
-                "log": log,
-            },
+        return Response(
+            stream_with_context(stream(offset)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
 
     @app.route("/run/add-file", methods=["POST"])
     def add_file():
-        f = request.files["file"]
-        f.save("input/" + secure_filename(f.filename))
-        files = {"file": f.read()}
+        try:
+            # Before the form is parsed, spooling its files to disk
+            input_uploads.check_form(request.content_length)
+            for f in request.files.getlist("file"):
+                input_uploads.save(secure_filename(f.filename), f.stream)
+        except uploads.UploadError as ex:
+            return (
+                render_template(
+                    "layout.html",
+                    action="generic_message",
+                    data={
+                        "breadcrumb": ["Co2mpas", "File not uploaded"],
+                        "props": {"active": {"run": "active", "doc": "", "expert": ""}},
+                        "title": "File not uploaded",
+                        "message": str(ex),
+                    },
+                ),
+                ex.status,
+            )
         return redirect("/run/simulation-form", code=302)
 
+    @app.route("/run/upload", methods=["POST"])
+    def start_upload():
+        try:
+            upload_id, offset, done = input_uploads.start(
+                secure_filename(request.args.get("name", "")),
+                request.args.get("size", -1, type=int),
+                request.args.get("sha256") or None,
+                request.args.get("modified"),
+            )
+        except uploads.UploadError as ex:
+            return jsonify({"error": str(ex)}), ex.status
+        return jsonify({"id": upload_id, "offset": offset, "done": done})
+
+    @app.route("/run/upload/<upload_id>", methods=["PUT"])
+    def upload_chunk(upload_id):
+        upload_id = secure_filename(upload_id)
+        offset = request.args.get("offset", -1, type=int)
+        try:
+            offset, done = input_uploads.write(upload_id, offset, request.stream)
+        except uploads.UploadError as ex:
+            body = {"error": str(ex)}
+            if ex.status == 409:
+                # To resume from the bytes received
+                body["offset"] = input_uploads.offset(upload_id)
+            return jsonify(body), ex.status
+        return jsonify({"offset": offset, "done": done})
+
     @app.route("/run/delete-file", methods=["GET"])
     def delete_file():
         fn = request.args.get("fn")
         inputs = [f for f in listdir_inputs("input") if isfile(join("input", f))]
-        os.remove("input/" + inputs[int(fn) - 1])
+        fpath = "input/" + inputs[int(fn) - 1]
+        cache.discard_parsed(fpath)
+        os.remove(fpath)
         return redirect("/run/simulation-form", code=302)
 
     @app.route("/run/view-results")
     def view_results():
 
-        dirpath = r"output"
-        entries = (os.path.join(dirpath, fn) for fn in os.listdir(dirpath))
-        entries = ((os.stat(path), path) for path in entries)
-        entries = (
-            (stat[ST_CTIME], path) for stat, path in entries if S_ISDIR(stat[ST_MODE])
+        args = request.args
+        per_page = app.config["CO2WUI_RESULTS_PER_PAGE"]
+        page = max(args.get("page", 1, type=int), 1)
+        sort = args.get("sort") if args.get("sort") in RESULT_SORTS else "date"
+        order = "asc" if args.get("order") == "asc" else "desc"
+        state = args.get("state") if args.get("state") in RESULT_STATES else None
+        flags = [flag for flag in simulation.FLAGS if args.get(flag)]
+
+        # One more, to know if there is a next page
+        found = job_store.find(
+            since=_timestamp(args.get("since")),
+            until=_timestamp(args.get("until"), days=1),
+            state=state,
+            flags=flags,
+            sort=RESULT_SORTS[sort],
+            descending=order == "desc",
+            offset=(page - 1) * per_page,
+            limit=per_page + 1,
         )
 
         results = []
-        for cdate, path in sorted(entries):
-            dirname = os.path.basename(path)
-            output_files = [
-                f
-                for f in listdir_outputs("output/" + dirname)
-                if isfile(join("output/" + dirname, f))
-            ]
+        for job, files in found[:per_page]:
             results.append(
-                {"datetime": time.ctime(cdate), "name": dirname, "files": output_files}
+                {
+                    "datetime": time.ctime(job.submitted),
+                    "name": job.id,
+                    "state": job.state,
+                    "error": job.error,
+                    "flags": [
+                        label
+                        for flag, label in simulation.FLAGS.items()
+                        if job.flags.get(flag)
+                    ],
+                    "files": [(file_id, name) for file_id, name, size in files],
+                }
             )
 
+        # Those still queued or running, to follow or cancel, once those of
+        # the processes gone are interrupted
+        job_store.interrupt()
+        unfinished = [
+            {
+                "datetime": time.ctime(job.submitted),
+                "name": job.id,
+                "state": job.state,
+                "priority": run_priority(job.flags),
+                "ahead": executor.ahead(job.id),
+            }
+            for job in job_store.unfinished()
+        ]
+
+        filters = {k: args[k] for k in ("since", "until", "state") if args.get(k)}
+        filters.update((flag, "on") for flag in flags)
+        listed = {
+            "results": results,
+            "unfinished": unfinished,
+            "first": (page - 1) * per_page,
+            "page": page,
+            "has_next": len(found) > per_page,
+            "sort": sort,
+            "order": order,
+            "filters": filters,
+            "usage": output_retention.usage(),
+        }
+        if args.get("format") == "json":
+            return jsonify(listed)
+
         return render_template(
             "layout.html",
             action="view_results",
-            data={
-                "breadcrumb": ["Co2mpas", "View results"],
-                "props": {"active": {"run": "active", "doc": "", "expert": ""}},
-                "results": reversed(results),
-            },
+            data=dict(
+                listed,
+                breadcrumb=["Co2mpas", "View results"],
+                props={"active": {"run": "active", "doc": "", "expert": ""}},
+                flags=simulation.FLAGS,
+            ),
         )
 
-    @app.route("/run/download-result/<runid>/<fnum>")
-    def download_result(runid, fnum):
-
-        files = list(listdir_outputs("output/" + runid))
-        rf = "output/" + runid + "/" + files[int(fnum) - 1]
+    @app.route("/run/download-result/<runid>/<int:file_id>")
+    def download_result(runid, file_id):
 
-        # Read from file
-        data = None
-        with open(rf, "rb") as xlsx:
-            data = xlsx.read()
+        # Files are identified by their id in the results catalog
+        found = job_store.get_file(file_id)
+        if found is None or found[0] != runid:
+            abort(404)
+        rf = "output/" + runid + "/" + found[1]
+        if not isfile(rf):
+            abort(404)
 
-        # Output xls file
-        iofile = io.BytesIO(data)
-        iofile.seek(0)
+        # Streamed from disk, with range and conditional requests
+        downloads.inc(kind="result")
+        job_store.touch(runid)
         return send_file(
-            iofile, attachment_filename=files[int(fnum) - 1], as_attachment=True
+            osp.abspath(rf),
+            attachment_filename=found[1],
+            as_attachment=True,
+            conditional=True,
+            cache_timeout=0,
         )
 
     @app.route("/run/download-log/<runid>")
     def download_log(runid):
 
-        rf = "output/" + runid + "/logfile.txt"
+        # Text logs predate the structured ones, and old ones are compressed
+        folder = "output/" + secure_filename(runid)
+        for name in (runlog.LOGFILE, "logfile.txt", runlog.LOGFILE + ".gz"):
+            rf = osp.join(folder, name)
+            if isfile(rf):
+                break
+        else:
+            abort(404)
+        downloads.inc(kind="log")
+        job_store.touch(runid)
+        structured = name != "logfile.txt"
+        if structured and request.args.get("format") != "json":
+            level = request.args.get("level", "DEBUG").upper()
+            if level not in runlog.LEVELS:
+                abort(400)
 
-        # Read from file
-        data = None
-        with open(rf, "rb") as xlsx:
-            data = xlsx.read()
+            # As text, reading only the records of the level, in one pass
+            def text():
+                lines = []
+                for record in logtail.iter_records(folder, logging.getLevelName(level)):
+                    lines.append(logtail.format_record(record))
+                    if len(lines) == 1000:
+                        yield "".join(lines)
+                        lines = []
+                yield "".join(lines)
 
-        # Output xls file
-        iofile = io.BytesIO(data)
-        iofile.seek(0)
-        return send_file(iofile, attachment_filename="logfile.txt", as_attachment=True)
+            return Response(
+                stream_with_context(text()),
+                mimetype="text/plain",
+                headers={"Content-Disposition": "attachment; filename=logfile.txt"},
+            )
+
+        return send_file(
+            osp.abspath(rf),
+            mimetype="application/gzip" if name.endswith(".gz") else "text/plain",
+            attachment_filename=name,
+            as_attachment=True,
+            conditional=True,
+            cache_timeout=0,
+        )
+
+    @app.route("/run/profile/<runid>")
+    def run_profile(runid):
+
+        rf = "output/" + secure_filename(runid) + "/" + timings.PROFILE
+        if not isfile(rf):
+            abort(404)
+        if request.args.get("format") == "json":
+            return send_file(
+                osp.abspath(rf),
+                mimetype="application/json",
+                conditional=True,
+                cache_timeout=0,
+            )
+
+        profile = timings.load(rf)
+        return render_template(
+            "layout.html",
+            action="run_profile",
+            data={
+                "breadcrumb": ["Co2mpas", "Profile of the simulation"],
+                "props": {"active": {"run": "active", "doc": "", "expert": ""}},
+                "run_id": runid,
+                "profile": profile,
+                "hotspots": timings.hotspots(profile),
+            },
+        )
+
+    @app.route("/run/export", methods=["GET", "POST"])
+    def export_results():
+
+        run_ids = list(
+            dict.fromkeys(secure_filename(r) for r in request.values.getlist("run"))
+        )
+        if not run_ids:
+            abort(400)
+        files = job_store.get_files(run_ids)
+
+        def entries():
+            for run_id in run_ids:
+                names = [name for file_id, name, size in files[run_id]]
+                logs = [runlog.LOGFILE, runlog.LOGFILE + ".gz", "logfile.txt"]
+                for name in names + logs:
+                    yield run_id + "/" + name, "output/" + run_id + "/" + name
+
+        # Generated while sent, xlsx files may be just stored
+        downloads.inc(kind="export")
+        for run_id in run_ids:
+            job_store.touch(run_id)
+        chunks = export.zip_stream(entries(), compress=not request.values.get("store"))
+        return Response(
+            stream_with_context(chunks),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=co2mpas-results.zip"},
+            direct_passthrough=True,
+        )
+
+    @app.route("/run/delete-results", methods=["POST"])
+    def delete_results():
+        run_ids = list(
+            dict.fromkeys(secure_filename(r) for r in request.form.getlist("run"))
+        )
+        # Only the runs over, the others are still writing their results
+        jobs_found = [executor.get(run_id) for run_id in run_ids]
+        output_retention.delete([job.id for job in jobs_found if job and job.done])
+        return redirect("/run/view-results", code=303)
 
     @app.route("/not-implemented")
     def not_implemented():
@@ -303,15 +849,186 @@ def create_app(configfile=None):
             },
         )
 
+    # Prepared once, before the first request, or before forking the web
+    # workers; the app alone is cheap, e.g. only to list the commands
+    start_lock = threading.Lock()
+
+    def start_up():
+        with start_lock:
+            if "co2wui.startup" in app.extensions:
+                return
+            # Each phase of the startup is timed, and reported once over
+            startup = timings.Profiler()
+            startup.start("startup")
+            with startup.timed("store"):
+                # The runs of the sessions over
+                job_store.interrupt()
+                job_store.sync("output", lambda folder: list(listdir_outputs(folder)))
+                refresh_usage()
+            with startup.timed("assets"):
+                static_assets.build()
+                os.makedirs(templates, exist_ok=True)
+
+            profile = startup.stop()
+            app.extensions["co2wui.startup"] = profile
+            startup_seconds.set(profile["wall"], phase="total")
+            for phase in profile["children"]:
+                startup_seconds.set(phase["wall"], phase=phase["name"])
+            log.info(
+                "Started in %.2f s (%s).",
+                profile["wall"],
+                ", ".join(
+                    "%s %.2f s" % (p["name"], p["wall"]) for p in profile["children"]
+                ),
+            )
+
+    app.extensions["co2wui.start_up"] = start_up
+
+    @app.before_first_request
+    def start_serving():
+        start_up()
+        # In each web worker, the threads not surviving the fork
+        if app.config["CO2WUI_RETENTION_INTERVAL"]:
+            output_retention.start(app.config["CO2WUI_RETENTION_INTERVAL"])
+
     return app
 
 
 @click.group(cls=FlaskGroup, create_app=create_app)
-def cli():
+@click.pass_context
+def cli(ctx):
     """Management script for the Wiki application."""
     # FIXME: read port from cli/configs
     # TODO: option for the user to skip opening browser
-    webbrowser.open("http:localhost:5000")
+    if ctx.invoked_subcommand not in ("batch", "serve"):
+        webbrowser.open("http:localhost:5000")
+
+
+@cli.command("serve", with_appcontext=False)
+@click.option("--bind", default="127.0.0.1:5000", help="Address to listen on.")
+@click.option("--workers", default=1, help="Web worker processes.")
+@click.option("--threads", default=16, help="Requests served at once by each.")
+@click.option(
+    "--config",
+    "configfile",
+    type=click.Path(exists=True, dir_okay=False),
+    help="The settings, see `create_app`.",
+)
+def serve(bind, workers, threads, configfile):
+    """Serve the web UI with many processes and threads, for production.
+
+    The web workers are forked from a single app, so they share the job
+    store, run logs and results, and any of them answers about any run;
+    each one runs the simulations submitted to it on its own pool, of its
+    share of the `CO2WUI_WORKERS` and `CO2WUI_QUEUE_SIZE`.
+
+    A run split in parts uses at most the pool of its web worker, hence a
+    single one by default, its threads serving the pages.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise click.ClickException("Serving needs gunicorn: pip install gunicorn")
+
+    # Built once, e.g. the dispatcher, then inherited by all web workers
+    app = create_app(configfile and osp.abspath(configfile))
+    app.extensions["co2wui.start_up"]()
+    if app.config["CO2WUI_PRELOAD"]:
+        simulation.warm_up()
+
+    # The simulations running, and waiting, are bounded across web workers
+    executor = app.extensions["co2wui.executor"]
+    executor.workers = max(executor.workers // workers, 1)
+    if executor.queue_size is not None:
+        executor.queue_size = max(executor.queue_size // workers, 1)
+    app.config["CO2WUI_WORKERS"] = executor.workers
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", bind)
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            # Threads, for the progress streamed to browsers as runs last
+            self.cfg.set("worker_class", "gthread")
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+@cli.command("batch", with_appcontext=False)
+@click.argument("inputs")
+@click.option("--only-summary", is_flag=True, help="Only summary.")
+@click.option("--hard-validation", is_flag=True, help="Hard validation.")
+@click.option("--declaration-mode", is_flag=True, help="Declaration mode.")
+@click.option(
+    "--tamode", "--type-approval-mode", is_flag=True, help="Type approval mode."
+)
+@click.option("--workers", type=int, help="Simulations run in parallel [CPUs].")
+@click.option("--timeout", type=float, help="Seconds each simulation may run.")
+@click.option("--log-level", type=click.Choice(runlog.LEVELS), default="INFO")
+@click.option("--jobs-db", default="output/jobs.db", help="The database of the runs.")
+@click.option("--summary", "summary_file", help="The JSON report written.")
+def run_batch(inputs, workers, timeout, log_level, jobs_db, summary_file, **flags):
+    """Simulate each input file in the folder, or matching the glob, INPUTS.
+
+    Every file is a run of its own, in `output`, as if submitted from the
+    web UI; the timings and failures of all are reported in a JSON summary,
+    and the exit status is 1 if any failed.
+    """
+    files = batch.find_inputs(inputs)
+    if not files:
+        raise click.UsageError("No input files in %r." % inputs)
+    args = {flag: "on" for flag, value in flags.items() if value}
+    args["log_level"] = log_level
+
+    os.makedirs("output", exist_ok=True)
+    job_store = store.JobStore(jobs_db)
+
+    def index_results(job):
+        folder = simulation.output_folder(job.id)
+        job_store.index_run(job.id, folder, list(listdir_outputs(folder)))
+
+    # Built once, before forking the workers
+    simulation.warm_up()
+    started, runs = time.time(), []
+    for fpath, job in batch.run(
+        files,
+        simulation.run_process,
+        args,
+        workers,
+        simulation.init_worker,
+        job_store,
+        index_results,
+        timeout,
+    ):
+        runs.append((fpath, job))
+        click.echo(
+            "[%d/%d] %s %s in %.1f s (%s)"
+            % (
+                len(runs),
+                len(files),
+                fpath,
+                job.state,
+                job.finished - job.started,
+                job.id,
+            )
+        )
+
+    report = batch.summary(runs, started, time.time())
+    summary_file = summary_file or time.strftime("output/batch-%Y%m%d-%H%M%S.json")
+    with open(summary_file, "w") as f:
+        json.dump(report, f, indent=2)
+    for run in report["runs"]:
+        if run["error"]:
+            click.echo("%s failed: %s" % (run["input"], run["error"]), err=True)
+    click.echo(
+        "%d of %d simulations succeeded in %.1f s, summary in %s"
+        % (report["succeeded"], report["total"], report["wall"], summary_file)
+    )
+    if report["failed"]:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+"""Fingerprinted, precompressed bundles of the static assets of the pages.
+
+The scripts and style sheets the pages include are concatenated into a few
+bundles, named after the digest of their content, and stored beside their
+gzipped and, if brotli is installed, brotli-compressed copies; the files
+the style sheets refer to, e.g. fonts, are fingerprinted alike.  A URL never
+changes content, so browsers may cache it for good.  Only the files of the
+manifest are served, not the unused trees of the static folder.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import os.path as osp
+import posixpath
+import re
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+#: The bundles of the static files, concatenated in order.
+BUNDLES = {
+    "js/vendor.js": [
+        "bower_components/jquery/dist/jquery.min.js",
+        "bower_components/jquery-ui/jquery-ui.min.js",
+    ],
+    "js/app.js": [
+        "bower_components/bootstrap/dist/js/bootstrap.min.js",
+        "bower_components/jquery-sparkline/dist/jquery.sparkline.min.js",
+        "bower_components/jquery-knob/dist/jquery.knob.min.js",
+        "bower_components/moment/min/moment.min.js",
+        "bower_components/bootstrap-daterangepicker/daterangepicker.js",
+        "bower_components/bootstrap-datepicker/dist/js/bootstrap-datepicker.min.js",
+        "plugins/bootstrap-wysihtml5/bootstrap3-wysihtml5.all.min.js",
+        "bower_components/jquery-slimscroll/jquery.slimscroll.min.js",
+        "bower_components/fastclick/lib/fastclick.js",
+        "dist/js/adminlte.min.js",
+    ],
+    "css/app.css": [
+        "bower_components/bootstrap/dist/css/bootstrap.min.css",
+        "bower_components/font-awesome/css/font-awesome.min.css",
+        "dist/css/AdminLTE.min.css",
+        "dist/css/skins/_all-skins.min.css",
+        "bower_components/bootstrap-datepicker/dist/css/bootstrap-datepicker.min.css",
+        "bower_components/bootstrap-daterangepicker/daterangepicker.css",
+        "plugins/bootstrap-wysihtml5/bootstrap3-wysihtml5.min.css",
+        "css/co2mpas.css",
+    ],
+}
+
+#: Other static files the pages refer to.
+FILES = ["images/co2mpas-banner.svg"]
+
+#: The types worth compressing; images and woff fonts are compressed already.
+COMPRESSED = (".js", ".css", ".svg", ".eot", ".ttf")
+
+#: The encodings stored, by preference, with their file extension.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+#: Built at startup: the best quality would take seconds, for a few % less.
+BROTLI_QUALITY = 9
+
+_URL = re.compile(rb"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_SOURCE_MAP = re.compile(rb"^/[*/]# sourceMappingURL=.*$", re.M)
+
+
+def fingerprint(name, data):
+    """The `name` of a static file, with the digest of its `data` in it."""
+    stem, ext = posixpath.splitext(name)
+    return "%s.%s%s" % (stem, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def _accepts(accept_encoding, encoding):
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() == encoding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00")
+    return False
+
+
+class Assets(object):
+    """The `bundles` of the files in `static`, and its `files`, built in `folder`.
+
+    The :attr:`manifest` maps the names of the bundles, and of the files they
+    refer to, to their fingerprinted names.
+    """
+
+    def __init__(self, static, folder, bundles=BUNDLES, files=FILES):
+        self.static = static
+        self.folder = folder
+        self.bundles = bundles
+        self.files = files
+        self.manifest = {}
+        self._served = set()
+
+    def _read(self, name):
+        with open(osp.join(self.static, *name.split("/")), "rb") as f:
+            return f.read()
+
+    def _write(self, name, data):
+        path = osp.join(self.folder, *name.split("/"))
+        if osp.isfile(path):
+            return  # same name, same content
+        log.info("Building static asset %s.", name)
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        copies = [("", data)]
+        if name.endswith(COMPRESSED):
+            copies.append((".gz", gzip.compress(data, 9, mtime=0)))
+            if brotli:
+                copies.append((".br", brotli.compress(data, quality=BROTLI_QUALITY)))
+        # The file itself last, as it tells the others are there
+        for ext, content in reversed(copies):
+            if ext and len(content) >= len(data):
+                continue
+            fd, tmp = tempfile.mkstemp(dir=osp.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp, path + ext)
+
+    def _add(self, name, data):
+        fp = self.manifest[name] = fingerprint(name, data)
+        self._write(fp, data)
+        return fp
+
+    def _rewrite(self, src, bundle, data):
+        # Refers to the fingerprinted files, relative to the bundle
+        def refer(match):
+            quote, ref = match.groups()
+            if re.match(rb"[a-z]+:|/|#", ref):
+                return match.group(0)
+            path, suffix = re.match(rb"([^?#]*)(.*)", ref).groups()
+            name = posixpath.normpath(
+                posixpath.join(posixpath.dirname(src), path.decode())
+            )
+            fp = self.manifest.get(name) or self._add(name, self._read(name))
+            rel = posixpath.relpath(fp, posixpath.dirname(bundle)).encode()
+            return b"url(" + quote + rel + suffix + quote + b")"
+
+        return _URL.sub(refer, data)
+
+    def build(self):
+        """Build the bundles and the files they refer to, if changed."""
+        self.manifest = {}
+        for name in self.files:
+            self._add(name, self._read(name))
+        for name, sources in self.bundles.items():
+            parts = []
+            for src in sources:
+                data = _SOURCE_MAP.sub(b"", self._read(src))
+                if name.endswith(".css"):
+                    data = self._rewrite(src, name, data)
+                parts.append(data.strip())
+            # Scripts may lack their final semicolon
+            sep = b"\n;\n" if name.endswith(".js") else b"\n"
+            self._add(name, sep.join(parts) + b"\n")
+        self._served = set(self.manifest.values())
+        self._prune()
+        return self.manifest
+
+    def _prune(self):
+        # The files of the previous builds
+        for root, _, files in os.walk(self.folder):
+            for fname in files:
+                path = osp.join(root, fname)
+                name = osp.relpath(path, self.folder).replace(os.sep, "/")
+                for _, ext in ENCODINGS:
+                    if name.endswith(ext):
+                        name = name[: -len(ext)]
+                if name not in self._served:
+                    os.remove(path)
+
+    def url(self, name):
+        """The URL of the static file or bundle `name`."""
+        return "/static/" + self.manifest[name]
+
+    def lookup(self, name, accept_encoding=""):
+        """The path and encoding of the fingerprinted file `name` to send.
+
+        Its smallest copy among the `accept_encoding` is preferred; ``None``
+        if the file is not served.
+        """
+        if name not in self._served:
+            return None
+        path = osp.join(self.folder, *name.split("/"))
+        for encoding, ext in ENCODINGS:
+            if _accepts(accept_encoding, encoding) and osp.isfile(path + ext):
+                return path + ext, encoding
+        return path, None
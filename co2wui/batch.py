@@ -0,0 +1,90 @@
+"""Headless simulations of many input files, without the web server.
+
+Each input file is simulated as a run of its own, on a pool of workers, in
+the same ``output/<run>`` layout as the runs of the web UI; the outcome of
+all of them is summarized in a machine-readable report.
+"""
+
+import glob
+import os.path as osp
+import queue
+
+from co2wui import jobs
+
+
+def find_inputs(pattern):
+    """The excel files in the folder `pattern`, or those matching it as a glob."""
+    if osp.isdir(pattern):
+        pattern = osp.join(pattern, "*.xls*")
+    return sorted(f for f in glob.glob(pattern) if osp.isfile(f))
+
+
+def run(
+    files,
+    fn,
+    args,
+    workers=None,
+    initializer=None,
+    store=None,
+    on_done=None,
+    timeout=None,
+):
+    """Run ``fn(run_id, args, [file])`` for each of `files`, in parallel.
+
+    Yields ``(file, job)`` as each run is over, `on_done` being called with
+    its :class:`jobs.Job` before; the runs are recorded in the `store`, if
+    any, with `args` as their flags.  Runs taking over `timeout` seconds
+    are killed, and failed.
+    """
+    over = queue.Queue()
+
+    def job_done(job):
+        try:
+            if on_done:
+                on_done(job)
+        finally:
+            over.put(job)
+
+    executor = jobs.JobExecutor(
+        workers, initializer=initializer, store=store, on_done=job_done
+    )
+    completed = False
+    try:
+        inputs = {}
+        for fpath in files:
+            run_id = jobs.new_run_id()
+            executor.submit(
+                run_id, fn, run_id, args, [fpath], flags=args, timeout=timeout
+            )
+            inputs[run_id] = fpath
+        for _ in files:
+            job = over.get()
+            yield inputs[job.id], job
+        completed = True
+    finally:
+        # Interrupted, the runs left are killed
+        executor.shutdown(wait=completed)
+
+
+def summary(runs, started, ended):
+    """The timings and failures of the `runs`, a list of ``(file, job)``."""
+    failed = [job for _, job in runs if job.state == jobs.FAILED]
+    return {
+        "started": started,
+        "ended": ended,
+        "wall": ended - started,
+        "total": len(runs),
+        "succeeded": len(runs) - len(failed),
+        "failed": len(failed),
+        "runs": [
+            {
+                "input": fpath,
+                "run_id": job.id,
+                "state": job.state,
+                "wait": job.started - job.submitted,
+                "duration": job.finished - job.started,
+                "error": job.error,
+            }
+            for fpath, job in runs
+        ],
+    }
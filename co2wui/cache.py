@@ -0,0 +1,341 @@
+"""Content-addressed on-disk caches.
+
+Files are stored once, under the sha256 digest of their content, and named
+references (e.g. the input template of a co2mpas version) point to them.
+The results of simulations are stored under the digest of what produced
+them, within a size limit, evicting the least recently used.
+The data parsed from input files is pickled next to them, by digest too.
+"""
+
+import functools
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import os.path as osp
+import pickle
+import shutil
+import tempfile
+import uuid
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+#: Sub-folder of the data parsed from the input files beside it.
+PARSED_FOLDER = ".parsed"
+
+
+def file_digest(path):
+    """The sha256 hex-digest of the content of the file at `path`."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _digest_path(path):
+    return osp.join(osp.dirname(path), ".sha256", osp.basename(path))
+
+
+def record_digest(path, digest):
+    """Keep the `digest` of the file at `path`, e.g. computed while uploading.
+
+    It is valid while the file keeps its size and modification time.
+    """
+    st = os.stat(path)
+    ref = _digest_path(path)
+    os.makedirs(osp.dirname(ref), exist_ok=True)
+    with open(ref, "w") as f:
+        json.dump([digest, st.st_size, st.st_mtime_ns], f)
+
+
+def known_digest(path):
+    """The digest of the file at `path`, computed only if not kept already."""
+    st = os.stat(path)
+    try:
+        with open(_digest_path(path)) as f:
+            digest, size, mtime = json.load(f)
+        if (size, mtime) == (st.st_size, st.st_mtime_ns):
+            return digest
+    except (OSError, ValueError):
+        pass
+    digest = file_digest(path)
+    record_digest(path, digest)
+    return digest
+
+
+class ContentCache(object):
+    """A store of files by content digest, rooted at `folder`."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, digest):
+        """Where the file with `digest` is (or would be) stored."""
+        return osp.join(self.folder, "blobs", digest[:2], digest)
+
+    def _ref_path(self, key):
+        return osp.join(self.folder, "refs", key)
+
+    def mkstemp(self, suffix=""):
+        """A new temporary file, on the same filesystem of the cache."""
+        tmp = osp.join(self.folder, "tmp")
+        os.makedirs(tmp, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=tmp)
+        os.close(fd)
+        return path
+
+    def put(self, path, key=None):
+        """Move the file at `path` into the cache, and return its digest.
+
+        If `key` is given, it is made to refer to the stored file.
+        """
+        digest = file_digest(path)
+        dst = self.path(digest)
+        os.makedirs(osp.dirname(dst), exist_ok=True)
+        os.replace(path, dst)
+        if key is not None:
+            self.link(key, digest)
+        return digest
+
+    def link(self, key, digest):
+        """Make `key` refer to the stored file with `digest`."""
+        ref = self._ref_path(key)
+        os.makedirs(osp.dirname(ref), exist_ok=True)
+        tmp = self.mkstemp()
+        with open(tmp, "w") as f:
+            f.write(digest)
+        os.replace(tmp, ref)
+
+    def lookup(self, key):
+        """The digest of the stored file `key` refers to, or ``None``."""
+        try:
+            with open(self._ref_path(key)) as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return digest if osp.isfile(self.path(digest)) else None
+
+
+def result_key(files, flags, version):
+    """The key of the results of a run on the input `files`.
+
+    It digests the name and content of each file, the `flags` and the
+    co2mpas `version`, all that makes a run reproduce the same results.
+    """
+    inputs = [(osp.basename(f), known_digest(f)) for f in files]
+    data = json.dumps([inputs, flags, version], sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _link(src, dst):
+    # Hard-link when possible, so that results take no more space
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultCache(object):
+    """The result files of runs by key, rooted at `folder`.
+
+    When the entries exceed `max_size` bytes, the least recently used ones
+    are evicted.  Entries are written and evicted atomically, so the cache
+    may be shared by many processes.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+
+    def _entry(self, key):
+        return osp.join(self.folder, "entries", key)
+
+    def get(self, key, dst):
+        """Link the files of entry `key` into folder `dst`.
+
+        Returns the names of the files, or ``None`` if there is no entry.
+        """
+        entry = self._entry(key)
+        linked = []
+        try:
+            for name in sorted(os.listdir(entry)):
+                _link(osp.join(entry, name), osp.join(dst, name))
+                linked.append(name)
+            os.utime(entry)  # recently used
+        except FileNotFoundError:
+            # Missing, or evicted meanwhile
+            for name in linked:
+                os.remove(osp.join(dst, name))
+            return None
+        return linked
+
+    def put(self, key, src, names):
+        """Store the files `names` of folder `src` as entry `key`."""
+        tmp = osp.join(self.folder, "tmp", uuid.uuid4().hex)
+        os.makedirs(tmp)
+        for name in names:
+            _link(osp.join(src, name), osp.join(tmp, name))
+        entry = self._entry(key)
+        os.makedirs(osp.dirname(entry), exist_ok=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Stored meanwhile by another run
+            shutil.rmtree(tmp)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond the size limit."""
+        entries = []
+        root = osp.join(self.folder, "entries")
+        for entry in os.scandir(root) if osp.isdir(root) else ():
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        os.makedirs(osp.join(self.folder, "tmp"), exist_ok=True)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            # Renamed first, so that no one reads it half-removed
+            trash = osp.join(self.folder, "tmp", uuid.uuid4().hex)
+            try:
+                os.rename(path, trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+
+
+class ParsedInputs(object):
+    """The data parsed from input files, pickled in a sub-folder beside them.
+
+    Entries are keyed by the digest of the content of the file, the
+    co2mpas `version` and the `parser` (see :func:`memoize_parsers`), so
+    they outlive renames and are stale as soon as any of them changes.
+    """
+
+    def __init__(self, version):
+        self.version = version
+
+    def _path(self, path, parser):
+        tag = hashlib.sha256(("%s %s" % (self.version, parser)).encode("utf-8"))
+        name = "%s-%s.pickle" % (known_digest(path), tag.hexdigest()[:16])
+        return osp.join(osp.dirname(path), PARSED_FOLDER, name)
+
+    def get(self, path, parser):
+        """The data `parser` parsed from the file at `path`, or :class:`KeyError`."""
+        try:
+            with open(self._path(path, parser), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(path)
+
+    def put(self, path, parser, data):
+        """Keep the `data` that `parser` parsed from the file at `path`."""
+        dst = self._path(path, parser)
+        os.makedirs(osp.dirname(dst), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=osp.dirname(dst))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, dst)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def discard_parsed(path):
+    """Remove the data parsed from the file at `path`, e.g. before deleting it."""
+    digest = known_digest(path)
+    folder = osp.join(osp.dirname(path), PARSED_FOLDER)
+    for entry in glob.glob(osp.join(folder, digest + "-*.pickle")):
+        os.remove(entry)
+
+
+def _input_path(arg):
+    # A path, or a file opened from a path
+    name = arg if isinstance(arg, str) else getattr(arg, "name", None)
+    return name if isinstance(name, str) and osp.isfile(name) else None
+
+
+_SIMPLE = (str, int, float, bool, type(None))
+
+
+def _key_part(value):
+    # Simple values only, never e.g. the content of a stream
+    if isinstance(value, _SIMPLE):
+        return repr(value)
+    if isinstance(value, (tuple, list)):
+        parts = [_key_part(v) for v in value]
+        if None not in parts:
+            return "[%s]" % ", ".join(parts)
+    return None
+
+
+def _parser_key(name, args, kwargs):
+    # The input file, keyed by digest, and the other arguments
+    path, key = None, [name]
+    for arg, value in itertools.chain(enumerate(args), sorted(kwargs.items())):
+        value_path = _input_path(value)
+        if value_path and path in (None, value_path):
+            path = value_path
+            continue
+        part = _key_part(value)
+        if part is None:
+            return None, None  # e.g. a stream with no path
+        key.append("%s=%s" % (arg, part))
+    return path, " ".join(key)
+
+
+def _memoized(fn, name, parsed):
+    @functools.wraps(fn)
+    def parse(*args, **kwargs):
+        path, parser = _parser_key(name, args, kwargs)
+        if path is None:
+            return fn(*args, **kwargs)
+
+        try:
+            data = parsed.get(path, parser)
+            log.info("Parsed data of %s reused.", path)
+            return data
+        except KeyError:
+            pass
+        except Exception:
+            log.warning("Cannot read the parsed data of %s.", path, exc_info=True)
+        data = fn(*args, **kwargs)
+        try:
+            parsed.put(path, parser, data)
+        except Exception:
+            log.warning("Cannot keep the parsed data of %s.", path, exc_info=True)
+        return data
+
+    parse._memoized = True
+    return parse
+
+
+def memoize_parsers(dsp, names, parsed, _seen=None):
+    """Reuse from `parsed` the data of the function nodes `names` of `dsp`.
+
+    The nodes are searched in the sub-dispatchers too; each call taking an
+    input file (or a file opened from it) is answered from the
+    :class:`ParsedInputs`, if kept already, and kept otherwise.
+    """
+    seen = set() if _seen is None else _seen
+    if id(dsp) in seen:
+        return
+    seen.add(id(dsp))
+    for node_id, attrs in dsp.nodes.items():
+        fn = attrs.get("function")
+        sub = getattr(fn, "dsp", None)
+        if sub is not None and hasattr(sub, "nodes"):
+            memoize_parsers(sub, names, parsed, seen)
+        elif node_id in names and not getattr(fn, "_memoized", False):
+            attrs["function"] = _memoized(fn, str(node_id), parsed)
@@ -0,0 +1,55 @@
+"""Streaming ZIP archives of run results.
+
+The archive is generated while it is sent, chunk by chunk, without any
+temporary file on disk, nor holding more than a chunk in memory.
+"""
+
+import os.path as osp
+import zipfile
+
+CHUNK_SIZE = 1 << 16
+
+
+class _Sink(object):
+    """A write-only, unseekable file, buffering what is written until drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def zip_stream(entries, compress=True, chunk_size=CHUNK_SIZE):
+    """Generate the chunks of a ZIP archive of the files in `entries`.
+
+    `entries` is an iterable of ``(arcname, path)``; missing files are
+    skipped.  Without `compress` files are just stored, which saves CPU
+    on already compressed files, like the xlsx workbooks.
+    """
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression) as zf:
+        for arcname, path in entries:
+            if not osp.isfile(path):
+                continue
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = compression
+            with open(path, "rb") as src, zf.open(zinfo, "w") as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
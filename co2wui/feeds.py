@@ -0,0 +1,100 @@
+"""Live feeds of the progress of runs, pushed to the browsers.
+
+A single reader thread per run follows its log and state, and broadcasts
+the changes to all the clients watching it, so the number of viewers does
+not multiply the reads of the log.  The log is followed through its index
+(see :func:`logtail.read_records`), reading only the records shown.
+"""
+
+import queue
+import threading
+import time
+
+from co2wui import jobs, logtail
+
+
+class Feed(object):
+    """Follows the log and state of a run, while anyone is subscribed.
+
+    Subscribers receive on their queue the events:
+
+    - ``("log", start, end, lines)``: the `lines` of the records shown,
+      between byte offsets `start` and `end` of the index of the log,
+    - ``("state", state)``: the new state of the run; after a final state
+      the feed stops.
+    """
+
+    def __init__(self, folder, get_state, interval=0.5, on_close=None):
+        self.folder = folder
+        self.get_state = get_state
+        self.interval = interval
+        self.on_close = on_close
+        self.offset = logtail.last_records(folder, 0)[1]  # the end of the log
+        self.state = get_state()
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """A new queue receiving the events, and the log offset it starts from."""
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.append(q)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            return q, self.offset, self.state
+
+    def unsubscribe(self, q):
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def _publish(self, event):
+        for q in self._subscribers:
+            q.put(event)
+
+    def _run(self):
+        while True:
+            # State first, so that lines logged before finishing are read
+            state = self.get_state()
+            records, end = logtail.read_records(self.folder, self.offset)
+            lines = [logtail.format_record(r) for r in records]
+            with self._lock:
+                if end != self.offset:
+                    self._publish(("log", self.offset, end, lines))
+                    self.offset = end
+                if state != self.state:
+                    self.state = state
+                    self._publish(("state", state))
+                final = state in (jobs.FINISHED, jobs.FAILED)
+                if final or not self._subscribers:
+                    self._thread = None
+                    break
+            time.sleep(self.interval)
+        if self.on_close:
+            self.on_close(self)
+
+
+class Feeds(object):
+    """The feeds of the runs being watched, created on demand."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def get(self, run_id, folder, get_state):
+        with self._lock:
+            feed = self._feeds.get(run_id)
+            if feed is None:
+                feed = self._feeds[run_id] = Feed(
+                    folder, get_state, self.interval, self._close
+                )
+            return feed
+
+    def _close(self, feed):
+        with self._lock:
+            for run_id, f in list(self._feeds.items()):
+                if f is feed:
+                    del self._feeds[run_id]
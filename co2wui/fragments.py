@@ -0,0 +1,38 @@
+"""Rendered once: the parts of the pages that change with few values only.
+
+The styles, scripts, topbar, sidebar and footer are the same on every page
+but for e.g. the section active; they are rendered once per such key, and
+the pages include the markup kept.
+"""
+
+import json
+import threading
+
+from markupsafe import Markup
+
+
+class Fragments(object):
+    """The templates of the jinja `env` rendered, by name and context."""
+
+    def __init__(self, env):
+        self.env = env
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def render(self, name, **context):
+        """The markup of the template `name`, rendered with `context` once.
+
+        The `context` must be all the template depends on, besides globals.
+        """
+        key = name, json.dumps(context, sort_keys=True)
+        html = self._rendered.get(key)
+        if html is None:
+            html = Markup(self.env.get_template(name).render(**context))
+            # Templates changing while debugging are rendered afresh
+            if not self.env.auto_reload:
+                with self._lock:
+                    self._rendered[key] = html
+        return html
+
+    def __len__(self):
+        return len(self._rendered)
@@ -0,0 +1,486 @@
+"""Process-pool executor for co2mpas simulations.
+
+Simulations are submitted as jobs to a pool of worker processes, so that
+concurrent runs scale with the cores instead of sharing the GIL of the web
+server, and a bounded queue keeps a burst of submissions from piling up.
+Waiting jobs start by priority; a job cancelled, or running past its
+timeout, has the workers running it killed, and replaced by fresh ones.
+"""
+
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from multiprocessing import connection
+
+log = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+#: The error of the jobs cancelled.
+CANCELLED = "Cancelled"
+
+#: Seconds between the checks of the jobs cancelled by other processes.
+CANCEL_POLL = 1.0
+
+#: Seconds the jobs stored are known to run, unless their process renews
+#: the lease; those of a process gone, e.g. crashed, are then interrupted.
+LEASE = 30.0
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the executor queue is full."""
+
+
+class Job(object):
+    """The state of a simulation submitted to the executor."""
+
+    def __init__(self, id, flags=None, priority=0, timeout=None):
+        self.id = id
+        self.flags = flags or {}
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        #: Jobs of higher priority start first, those equal in order.
+        self.priority = priority
+        #: Seconds the job may run, if limited.
+        self.timeout = timeout
+        #: Tasks of the job still to complete, and the one to run after them.
+        self.pending = 0
+        self.finalize = None
+
+    @property
+    def done(self):
+        return self.state in (FINISHED, FAILED)
+
+
+def new_run_id():
+    """A unique, time-sortable id for a run, also naming its output folder."""
+    return "%s-%s" % (time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:6])
+
+
+def _work(conn, initializer, max_tasks):
+    # Forked e.g. from a web worker, whose handler would ignore the signal
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if initializer:
+        initializer()
+    tasks = 0
+    while not max_tasks or tasks < max_tasks:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        fn, args = task
+        try:
+            result = True, fn(*args)
+        except Exception as ex:
+            result = False, ex
+        try:
+            conn.send(result)
+        except Exception as ex:
+            conn.send((False, "Cannot send back %r: %s" % (result[1], ex)))
+        tasks += 1
+
+
+def _context():
+    # Forked workers share the modules imported by the parent copy-on-write
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+class _Worker(object):
+    """A worker process, running the tasks sent through its pipe one by one."""
+
+    def __init__(self, ctx, initializer, max_tasks):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_work, args=(child, initializer, max_tasks), daemon=True
+        )
+        self.process.start()
+        child.close()
+        #: The job of the task running, kept once killed until it exits.
+        self.job = None
+        #: Tasks run, the worker exiting by itself after `max_tasks`.
+        self.tasks = 0
+        self.max_tasks = max_tasks
+
+    @property
+    def idle(self):
+        # Not sent more tasks once exiting, it would lose them
+        return self.job is None and not (
+            self.max_tasks and self.tasks >= self.max_tasks
+        )
+
+
+class JobExecutor(object):
+    """Run jobs on a pool of `workers` processes.
+
+    At most `queue_size` jobs may be waiting for a free worker; further
+    submissions raise :class:`QueueFull` (``None`` means unbounded).
+
+    Workers are forked from the current process where the platform allows,
+    so whatever it has already loaded is shared with them; `initializer` is
+    called once in each worker, and workers are replaced by fresh ones
+    after `max_tasks` tasks, to release any leaked memory.
+
+    With a `store` (see :class:`store.JobStore`) every change of the jobs is
+    persisted, and only the unfinished ones are kept in memory, their
+    leases renewed while the process runs.
+    The `on_done` callback is called with each job once it is over.
+
+    The pool is started on the first submission, in the process submitting,
+    so the executor may be created before forking e.g. web workers, each
+    then running its own pool; jobs are cancelled across them through the
+    `store`.
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        queue_size=None,
+        initializer=None,
+        max_tasks=None,
+        store=None,
+        on_done=None,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.store = store
+        self.on_done = on_done
+        self.initializer = initializer
+        self.max_tasks = max_tasks
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        self._ctx = _context()
+        self._jobs = {}
+        # Tasks waiting for a worker, by priority then submission
+        self._queue = []
+        self._order = itertools.count()
+        self._closing = False
+        self._renewed = time.time()
+        self._workers = [self._spawn() for _ in range(self.workers)]
+        self._wakeup, self._waker = self._ctx.Pipe(duplex=False)
+        self._manager = threading.Thread(target=self._manage, daemon=True)
+        self._manager.start()
+        self._pid = os.getpid()
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.initializer, self.max_tasks)
+
+    def _wake(self):
+        self._waker.send_bytes(b"")
+
+    def _manage(self):
+        # Dispatches the tasks, collects their results, and enforces limits
+        while True:
+            done = []
+            try:
+                if not self._step(done):
+                    break
+            except Exception:
+                # Would stop the thread managing the workers, e.g. if the
+                # database is busy, hanging all the jobs: retried instead
+                log.exception("Managing the jobs failed")
+                time.sleep(CANCEL_POLL)
+            finally:
+                self._notify(done)
+
+    def _step(self, done):
+        with self._lock:
+            self._retry_saves()
+            self._dispatch(done)
+            if self._closing and not self._busy():
+                return False
+            workers = list(self._workers)
+            timeout = self._next_check()
+        self._notify(done)
+        del done[:]
+        waited = [self._wakeup]
+        for w in workers:
+            waited += [w.conn, w.process.sentinel]
+        ready = set(connection.wait(waited, timeout))
+        cancelled = self._cancel_requests()
+        self._renew_leases()
+        with self._lock:
+            while self._wakeup.poll():
+                self._wakeup.recv_bytes()
+            for w in workers:
+                if w.conn in ready:
+                    self._receive(w, done)
+            for w in workers:
+                if w.process.sentinel in ready:
+                    self._exited(w, done)
+            self._enforce(cancelled, done)
+        return True
+
+    def _retry_saves(self):
+        # Jobs over are kept in memory until saved
+        if self.store is not None:
+            for job in list(self._jobs.values()):
+                if job.done:
+                    self._save(job)
+
+    def _busy(self):
+        running = any(w.job and not w.job.done for w in self._workers)
+        return running or any(not task[2].done for task in self._queue)
+
+    def _next_check(self):
+        checks = [
+            job.started + job.timeout - time.time()
+            for job in self._jobs.values()
+            if job.state == RUNNING and job.timeout
+        ]
+        if self.store is not None and self._jobs:
+            checks.append(CANCEL_POLL)
+        return max(min(checks), 0) if checks else None
+
+    def _cancel_requests(self):
+        # Queried unlocked, as the database may be busy
+        if self.store is None:
+            return ()
+        unfinished = list(self._jobs)
+        return self.store.pop_cancels(unfinished) if unfinished else ()
+
+    def _renew_leases(self):
+        # Well before expiring, polled along the cancellations
+        now = time.time()
+        if self.store is None or now < self._renewed + LEASE / 3:
+            return
+        unfinished = [job.id for job in list(self._jobs.values()) if not job.done]
+        if unfinished:
+            self.store.renew(unfinished, now)
+        self._renewed = now
+
+    def _enforce(self, cancelled, done):
+        now = time.time()
+        for job in list(self._jobs.values()):
+            if job.done:
+                continue
+            if job.id in cancelled:
+                self._stop(job, CANCELLED, done)
+            elif (
+                job.state == RUNNING
+                and job.timeout
+                and now >= job.started + job.timeout
+            ):
+                self._stop(job, "Timed out after %g s" % job.timeout, done)
+
+    def _dispatch(self, done):
+        idle = [w for w in self._workers if w.idle]
+        while idle and self._queue:
+            _, _, job, fn, args = heapq.heappop(self._queue)
+            if job.done:
+                continue  # cancelled while waiting
+            w = idle.pop()
+            try:
+                w.conn.send((fn, args))
+            except Exception as ex:
+                idle.append(w)
+                self._task_over(job, "Cannot run %r: %s" % (fn, ex), done)
+                continue
+            w.job = job
+            if job.state == QUEUED:
+                job.state, job.started = RUNNING, time.time()
+                self._save(job)
+
+    def _receive(self, w, done):
+        try:
+            ok, value = w.conn.recv()
+        except (EOFError, OSError):
+            return  # died, see _exited()
+        job, w.job = w.job, None
+        w.tasks += 1
+        if job is not None:
+            self._task_over(job, None if ok else value, done)
+
+    def _exited(self, w, done):
+        if w.job is not None and w.conn.poll():
+            self._receive(w, done)
+        w.process.join()
+        w.conn.close()
+        self._workers.remove(w)
+        if w.job is not None:
+            self._task_over(
+                w.job, "Worker exited with code %s" % w.process.exitcode, done
+            )
+        if not self._closing:
+            self._workers.append(self._spawn())
+
+    def _save(self, job):
+        if self.store is not None:
+            self.store.save(job)
+            if job.done:
+                del self._jobs[job.id]
+
+    def _apply(self, job, fn, args):
+        heapq.heappush(self._queue, (-job.priority, next(self._order), job, fn, args))
+
+    def _task_over(self, job, error, done):
+        if job.done:
+            return  # stopped meanwhile
+        if error is not None:
+            log.error("Job %s failed: %r", job.id, error)
+            job.error = job.error or str(error)
+        job.pending -= 1
+        if job.pending:
+            return
+        if job.finalize and not job.error:
+            (fn, args), job.finalize = job.finalize, None
+            job.pending = 1
+            self._apply(job, fn, args)
+            return
+        self._finish(job, FAILED if job.error else FINISHED, done)
+
+    def _finish(self, job, state, done):
+        job.state = state
+        job.finished = time.time()
+        job.started = job.started or job.finished
+        done.append(job)
+        self._save(job)
+
+    def _stop(self, job, error, done):
+        # Killed, the workers are replaced once exited
+        log.warning("Job %s stopped: %s", job.id, error)
+        for w in self._workers:
+            if w.job is job:
+                w.process.kill()
+        job.error = error
+        self._finish(job, FAILED, done)
+
+    def _notify(self, done):
+        for job in done:
+            if self.on_done:
+                try:
+                    self.on_done(job)
+                except Exception:
+                    # Would stop the thread managing the workers
+                    log.exception("Post-processing of job %s failed", job.id)
+
+    def count(self, state):
+        """Number of jobs currently in `state`."""
+        return sum(1 for job in list(self._jobs.values()) if job.state == state)
+
+    def ahead(self, job_id):
+        """The number of jobs to start before the queued `job_id`, or ``None``."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != QUEUED:
+                return None
+            # Jobs split in many tasks start with the first one
+            keys = {}
+            for task in self._queue:
+                if not task[2].done:
+                    keys[task[2].id] = min(keys.get(task[2].id, task[:2]), task[:2])
+            key = keys.get(job_id)
+            return key and sum(1 for k in keys.values() if k < key)
+
+    def submit(self, job_id, fn, *args, flags=None, priority=0, timeout=None):
+        """Queue ``fn(*args)`` for execution in a worker process.
+
+        `fn` and `args` must be picklable; `flags` are recorded with the job.
+        """
+        return self.submit_many(
+            job_id, fn, [args], flags=flags, priority=priority, timeout=timeout
+        )
+
+    def submit_many(
+        self, job_id, fn, args_list, finalize=None, flags=None, priority=0, timeout=None
+    ):
+        """Queue ``fn(*args)`` for each `args` in `args_list`, as a single job.
+
+        The calls run in parallel on the workers; once all have succeeded,
+        the optional `finalize` ``(fn, args)`` pair is executed as well.
+        The job fails if any of its calls fails, or if still running
+        `timeout` seconds after starting.  Jobs of higher `priority` start
+        first.
+        """
+        with self._lock:
+            self._start()
+            if self._closing:
+                raise RuntimeError("Shutting down")
+            if self.queue_size is not None and self.count(QUEUED) >= self.queue_size:
+                raise QueueFull("%d simulations already waiting" % self.queue_size)
+            job = Job(job_id, flags, priority, timeout)
+            job.pending, job.finalize = len(args_list), finalize
+            if self.store is not None:
+                self.store.add(job)
+            self._jobs[job_id] = job
+            for args in args_list:
+                self._apply(job, fn, args)
+        self._wake()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel the job `job_id`, killing its work if running.
+
+        Returns whether it was unfinished.  The jobs of other processes are
+        cancelled by their executor, sharing the `store`.
+        """
+        done = []
+        with self._lock:
+            job = self._jobs.get(job_id) if self._pid == os.getpid() else None
+            if job is not None and not job.done:
+                self._stop(job, CANCELLED, done)
+        if done:
+            self._wake()
+            self._notify(done)
+            return True
+        if self.store is not None:
+            return self.store.request_cancel(job_id)
+        return False
+
+    def get(self, job_id):
+        """The :class:`Job` with `job_id`, or ``None`` if never submitted."""
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.get(job_id)
+            if job is not None and not job.done and self.store.interrupt():
+                job = self.store.get(job_id)  # its process is gone
+        return job
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and, if `wait`, let the pending ones finish.
+
+        Otherwise the jobs left are killed, and failed as interrupted.
+        """
+        if self._pid != os.getpid():
+            return  # never started in this process
+        with self._lock:
+            self._closing = True
+            if not wait:
+                for job in list(self._jobs.values()):
+                    if not job.done:
+                        job.error = "Interrupted"
+                        self._finish(job, FAILED, [])
+                for w in self._workers:
+                    w.process.kill()
+        self._wake()
+        self._manager.join(None if wait else 5)
+        for w in list(self._workers):
+            if wait and w.process.is_alive() and w.idle:
+                try:
+                    w.conn.send(None)
+                except OSError:
+                    pass  # exited meanwhile
+            w.process.join(5)
+            if w.process.is_alive():
+                w.process.kill()
+                w.process.join()
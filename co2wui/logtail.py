@@ -0,0 +1,231 @@
+"""Incremental reading of the growing log of a run.
+
+Clients keep the byte offset up to which they have read, so each poll reads
+only what was appended since, and new viewers read just the last lines of
+the log, backwards from its end, whatever its size.
+
+The structured logs (see :mod:`runlog`) are read through their index: the
+offsets are those of the index, and only the records of the levels asked
+are read from the log.  Text logs are those of runs predating them.
+"""
+
+import collections
+import glob
+import gzip
+import json
+import logging
+import os
+import os.path as osp
+import re
+import time
+
+from co2wui import runlog
+
+CHUNK_SIZE = 1 << 16
+
+#: The lines shown to the user are all but the (many) INFO ones.
+_INFO = re.compile("- INFO -")
+
+#: The level of the records shown to the user.
+SHOWN = logging.WARNING
+
+
+def is_shown(line):
+    return not _INFO.search(line)
+
+
+def read_lines(path, offset=0, keep=is_shown, limit=1 << 20):
+    """The complete lines appended to `path` after byte `offset`, and their end.
+
+    At most `limit` bytes are read; the rest is left for the next call.
+    Returns ``(lines, offset)``, with the lines passing `keep`.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return [], offset
+    with f:
+        if os.fstat(f.fileno()).st_size < offset:
+            offset = 0  # rewritten
+        f.seek(offset)
+        data = f.read(limit)
+
+    end = data.rfind(b"\n") + 1
+    if not end and len(data) == limit:
+        end = limit  # a single line longer than `limit`
+    lines = data[:end].decode("utf-8", "replace").splitlines(True)
+    return [line for line in lines if keep(line)], offset + end
+
+
+def last_lines(path, n, keep=is_shown, block=CHUNK_SIZE):
+    """The last `n` complete lines of `path` passing `keep`, and their end.
+
+    The file is read backwards, block by block, until enough lines are found.
+    Returns ``(lines, offset)``, to continue with :func:`read_lines`.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return [], 0
+    lines = []
+    end = None
+    with f:
+        pos = os.fstat(f.fileno()).st_size
+        buf = b""
+        while pos > 0 and (end is None or len(lines) < n):
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            if end is None:
+                # Skip the last line, while it is being written
+                i = buf.rfind(b"\n")
+                if i < 0:
+                    continue
+                end, buf = pos + i + 1, buf[: i + 1]
+
+            # The first line is complete only at the start of the file
+            parts = buf.split(b"\n")[:-1]
+            buf = parts.pop(0) + b"\n" if pos else b""
+            for raw in reversed(parts):
+                if len(lines) >= n:
+                    break
+                line = raw.decode("utf-8", "replace") + "\n"
+                if keep(line):
+                    lines.append(line)
+    lines.reverse()
+    return lines, end or 0
+
+
+def _open_log(folder):
+    # Logs of old runs may be compressed (see :mod:`retention`), yet the
+    # offsets read are always increasing, so seeking stays forward only
+    path = osp.join(folder, runlog.LOGFILE)
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        return gzip.open(path + ".gz", "rb")
+
+
+def _read_at(folder, offsets):
+    records = []
+    if offsets:
+        with _open_log(folder) as f:
+            for offset in offsets:
+                f.seek(offset)
+                records.append(json.loads(f.readline().decode("utf-8", "replace")))
+    return records
+
+
+def read_records(folder, offset=0, level=SHOWN, limit=1 << 20):
+    """The records of the run in `folder` indexed after byte `offset`.
+
+    At most `limit` bytes of the index are read; the rest is left for the
+    next call.  Returns ``(records, offset)``, with the records at `level`
+    or above.
+    """
+    size = runlog.ENTRY.size
+    try:
+        f = open(osp.join(folder, runlog.INDEX), "rb")
+    except FileNotFoundError:
+        return [], offset
+    with f:
+        if os.fstat(f.fileno()).st_size < offset:
+            offset = 0  # rewritten
+        f.seek(offset)
+        data = f.read(limit - limit % size)
+
+    end = len(data) - len(data) % size
+    entries = runlog.ENTRY.iter_unpack(data[:end])
+    offsets = [pos for pos, levelno in entries if levelno >= level]
+    return _read_at(folder, offsets), offset + end
+
+
+def last_records(folder, n, level=SHOWN, block=CHUNK_SIZE):
+    """The last `n` records of the run in `folder` at `level` or above.
+
+    The index is read backwards, block by block, until enough records are
+    found.  Returns ``(records, offset)``, to continue with
+    :func:`read_records`.
+    """
+    size = runlog.ENTRY.size
+    block = max(block - block % size, size)
+    try:
+        f = open(osp.join(folder, runlog.INDEX), "rb")
+    except FileNotFoundError:
+        return [], 0
+    offsets = []
+    with f:
+        end = pos = os.fstat(f.fileno()).st_size // size * size
+        while pos > 0 and len(offsets) < n:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            entries = list(runlog.ENTRY.iter_unpack(f.read(step)))
+            for offset, levelno in reversed(entries):
+                if len(offsets) >= n:
+                    break
+                if levelno >= level:
+                    offsets.append(offset)
+    offsets.reverse()
+    return _read_at(folder, offsets), end
+
+
+def iter_records(folder, level=SHOWN, block=CHUNK_SIZE):
+    """All the records of the run in `folder` at `level` or above, in order.
+
+    The log is opened once and read forward, so that a compressed one is
+    decompressed in a single pass, whatever its size.
+    """
+    size = runlog.ENTRY.size
+    block = max(block - block % size, size)
+    try:
+        index = open(osp.join(folder, runlog.INDEX), "rb")
+    except FileNotFoundError:
+        return
+    with index, _open_log(folder) as f:
+        for data in iter(lambda: index.read(block), b""):
+            data = data[: len(data) - len(data) % size]
+            for offset, levelno in runlog.ENTRY.iter_unpack(data):
+                if levelno >= level:
+                    f.seek(offset)
+                    yield json.loads(f.readline().decode("utf-8", "replace"))
+
+
+def level_counts(folder):
+    """The number of records by level name in the log of the run in `folder`.
+
+    They are those counted by the processes logging the run, or else, for
+    runs logged before, those found reading the whole index.
+    """
+    counts = collections.Counter()
+    paths = glob.glob(osp.join(glob.escape(folder), runlog.COUNTS % "*"))
+    for path in paths:
+        counts.update(runlog.read_counts(path))
+    if paths:
+        return counts
+    try:
+        f = open(osp.join(folder, runlog.INDEX), "rb")
+    except FileNotFoundError:
+        return counts
+    size = runlog.ENTRY.size
+    with f:
+        for data in iter(lambda: f.read(CHUNK_SIZE - CHUNK_SIZE % size), b""):
+            data = data[: len(data) - len(data) % size]
+            counts.update(levelno for _, levelno in runlog.ENTRY.iter_unpack(data))
+    return collections.Counter(
+        {logging.getLevelName(levelno): n for levelno, n in counts.items()}
+    )
+
+
+def format_record(record):
+    """The text line of a structured log `record`."""
+    t = record["time"]
+    asctime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+    return "%s,%03d - %s - %s - %s\n" % (
+        asctime,
+        t % 1 * 1000,
+        record["logger"],
+        record["level"],
+        record["message"],
+    )
@@ -0,0 +1,170 @@
+"""In-memory metrics, exposed in the Prometheus text format.
+
+Counters and histograms are updated where things happen (submissions,
+requests, downloads, runs ending), and so are the gauges of the disk usage
+(runs indexed, removed or swept); the others are computed when scraped
+from the state held in memory, so a scrape never touches the filesystem,
+nor the store.  Each process keeps its own, told apart by a label, e.g.
+the pid of each web worker.
+"""
+
+import math
+import threading
+
+#: Buckets of the durations of the HTTP requests, in seconds.
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#: Buckets of the durations of the runs, in seconds.
+RUN_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("Labels of %s must be %s" % (self.name, self.labels))
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+    def _samples(self, extra):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            "%s%s %s" % (self.name, self._labels(k, extra), _number(v))
+            for k, v in items
+        ]
+
+    def render(self, extra=()):
+        lines = ["# HELP %s %s" % (self.name, self.help)]
+        lines.append("# TYPE %s %s" % (self.name, self.type))
+        lines.extend(self._samples(list(extra)))
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A total only increasing, by labels."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value going up and down, or computed by `fn` when scraped."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self, extra):
+        if self.fn is not None:
+            return [
+                "%s%s %s" % (self.name, self._labels((), extra), _number(self.fn()))
+            ]
+        return super()._samples(extra)
+
+
+class Histogram(_Metric):
+    """The distribution of observed values in `buckets`, by labels."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = counts, total + value
+
+    def _samples(self, extra):
+        with self._lock:
+            items = sorted((k, (c[:], t)) for k, (c, t) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = self._labels(key, extra + [("le", _number(bound))])
+                lines.append("%s_bucket%s %d" % (self.name, labels, cumulative))
+            labels = self._labels(key, extra)
+            lines.append("%s_sum%s %s" % (self.name, labels, _number(total)))
+            lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+
+class Registry(object):
+    """The metrics of an application, rendered together.
+
+    The `labels` are added to all samples; a callable value is called at
+    each rendering, e.g. :func:`os.getpid` in forked processes.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._add(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        extra = [(k, v() if callable(v) else v) for k, v in self.labels.items()]
+        return "\n".join(m.render(extra) for m in self._metrics) + "\n"
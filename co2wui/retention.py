@@ -0,0 +1,170 @@
+"""Retention of the results of past runs, within a disk quota and an age.
+
+A background thread periodically compresses in place the logs and dumps of
+the runs over for a while, removes the runs too old, and then, while the
+output folder exceeds its quota, those least recently downloaded.  Each web
+worker runs one, but only the first to claim it in the store sweeps, and the
+usage found is recorded there for all.
+"""
+
+import gzip
+import logging
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+
+from co2wui import runlog
+
+log = logging.getLogger(__name__)
+
+#: The files of a run compressed once old; xlsx files are zipped already.
+COMPRESSED = (runlog.LOGFILE, "result.dat")
+
+
+def folder_size(path):
+    """The size of the files in the folder at `path`, and its sub-folders."""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += folder_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def compress(path):
+    """Replace the file at `path` with its gzipped copy, ``<path>.gz``."""
+    tmp = path + ".gz.tmp"
+    with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    shutil.copystat(path, tmp)
+    os.replace(tmp, path + ".gz")
+    os.remove(path)
+
+
+class Retention(object):
+    """Keeps the runs of the `store`, in `folder`, within limits.
+
+    Runs finished more than `compress_after` seconds ago are compressed,
+    and those more than `max_age` ago removed; beyond `quota` bytes, the
+    least recently used are removed too.  Zero disables each limit.
+    `on_delete` is called with the ids of the runs removed, and `on_usage`
+    with the :meth:`usage` once changed, or checked by the background thread;
+    `on_sweep` with the time of each sweep, e.g. to clean other folders.
+    """
+
+    def __init__(
+        self,
+        store,
+        folder,
+        quota=0,
+        max_age=0,
+        compress_after=0,
+        on_delete=None,
+        on_usage=None,
+        on_sweep=None,
+    ):
+        self.store = store
+        self.folder = folder
+        self.quota = quota
+        self.max_age = max_age
+        self.compress_after = compress_after
+        self.on_delete = on_delete
+        self.on_usage = on_usage
+        self.on_sweep = on_sweep
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def usage(self):
+        """The ``bytes`` and ``runs`` in the folder, as of the last sweep."""
+        return dict(self.store.usage(), quota=self.quota)
+
+    def _compress(self, path):
+        for name in COMPRESSED:
+            fpath = osp.join(path, name)
+            if osp.isfile(fpath):
+                compress(fpath)
+
+    def sweep(self, now=None):
+        """Compress and remove the runs beyond the limits, once."""
+        now = time.time() if now is None else now
+        with self._lock:
+            runs, sizes, expired = self.store.by_last_use(), {}, []
+            for run_id, used, finished in runs:
+                path = osp.join(self.folder, run_id)
+                if self.compress_after and finished < now - self.compress_after:
+                    self._compress(path)
+                sizes[run_id] = folder_size(path)
+                if self.max_age and finished < now - self.max_age:
+                    expired.append(run_id)
+
+            total = sum(sizes.values()) - sum(sizes[r] for r in expired)
+            for run_id, _, _ in runs:
+                if not self.quota or total <= self.quota:
+                    break
+                if run_id not in expired:
+                    expired.append(run_id)
+                    total -= sizes[run_id]
+
+            if expired:
+                log.info("Removing %d runs, past their age or the quota.", len(expired))
+                self._delete(expired)
+            self.store.set_usage(total, len(runs) - len(expired), now)
+        if self.on_sweep:
+            self.on_sweep(now)
+        self._report()
+
+    def _delete(self, run_ids):
+        # Forgotten first, so that no page lists them half-removed
+        self.store.delete(run_ids)
+        for run_id in run_ids:
+            shutil.rmtree(osp.join(self.folder, run_id), ignore_errors=True)
+        if self.on_delete:
+            self.on_delete(run_ids)
+
+    def delete(self, run_ids):
+        """Remove the runs `run_ids`, and return their size."""
+        with self._lock:
+            freed = sum(folder_size(osp.join(self.folder, r)) for r in run_ids)
+            self._delete(run_ids)
+            self.store.reduce_usage(freed, len(run_ids))
+        self._report()
+        return freed
+
+    def _report(self):
+        if self.on_usage:
+            self.on_usage(self.usage())
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                if self.store.claim_sweep(interval):
+                    self.sweep()
+                else:
+                    self._report()  # as swept by another process
+            except Exception:
+                log.exception("Sweeping the results of past runs failed.")
+            self._stop.wait(interval)
+
+    def start(self, interval):
+        """Sweep every `interval` seconds, in a background thread.
+
+        Sweeps are skipped while another process swept within `interval`.
+        """
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,223 @@
+"""Routing of the log records of each run to its own structured log.
+
+In a worker process the root logger only queues the records, tagged with
+the run being executed; a listener thread writes them to the log of their
+run, and to the handlers of the application, so the simulation never waits
+for the disk and the handlers of the application stay in place.
+
+The log of a run is in JSON lines (:data:`LOGFILE`), each record with its
+time, level, logger, stage and message, and its index (:data:`INDEX`) holds
+the byte offset and level of every record, to read just those needed.
+Each process logging a run also keeps the number of its records by level,
+in a file of its own (:data:`COUNTS`), so they are known without reading
+the index.
+"""
+
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import os.path as osp
+import queue
+import struct
+import threading
+import time
+
+LOGFILE = "log.jsonl"
+INDEX = "log.idx"
+
+#: The levels a run may be logged at.
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+#: The entries of the index: the offset of a record in the log and its level.
+ENTRY = struct.Struct("<QB")
+
+#: The counts of the records by level, of each process (by pid) logging a run.
+COUNTS = "log.%s.levels"
+
+#: Seconds between the updates of the counts of the records below WARNING.
+COUNTS_DELAY = 1.0
+
+#: The run executed by this process, with its log level and current stage.
+_run = None
+_level = logging.NOTSET
+_stage = None
+
+_queue = None
+_listener = None
+
+
+class _RunFilter(logging.Filter):
+    def filter(self, record):
+        if _run is not None and record.levelno < _level:
+            return False
+        record.run, record.stage = _run, _stage
+        return True
+
+
+class _End(object):
+    """Queued after the last record of a run, to close its log."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.written = threading.Event()
+
+
+def to_json(record):
+    """The line of the structured log of a `record`."""
+    data = {
+        "time": record.created,
+        "level": record.levelname,
+        "logger": record.name,
+        "stage": getattr(record, "stage", None),
+        "message": record.getMessage(),
+    }
+    return json.dumps(data) + "\n"
+
+
+class _RunLog(object):
+    # Unbuffered, so that each record and its entry are appended at once,
+    # even when the parts of a run log from several processes
+    def __init__(self, folder):
+        self.log = open(osp.join(folder, LOGFILE), "ab", buffering=0)
+        self.index = open(osp.join(folder, INDEX), "ab", buffering=0)
+        # Continued, e.g. when logging another part of the run
+        self.counts_path = osp.join(folder, COUNTS % os.getpid())
+        self.counts = collections.Counter(read_counts(self.counts_path))
+        self.flushed = None
+
+    def write(self, record):
+        line = to_json(record).encode("utf-8")
+        self.log.write(line)
+        # After an append, the offset is the end of the line
+        offset = self.log.tell() - len(line)
+        self.index.write(ENTRY.pack(offset, min(record.levelno, 255)))
+        self.counts[record.levelname] += 1
+        # Those shown to the user at once, the many others now and then
+        now = time.monotonic()
+        if (
+            record.levelno >= logging.WARNING
+            or self.flushed is None
+            or now >= self.flushed + COUNTS_DELAY
+        ):
+            self.flush(now)
+
+    def flush(self, now=None):
+        tmp = "%s.tmp" % self.counts_path
+        with open(tmp, "w") as f:
+            json.dump(self.counts, f)
+        os.replace(tmp, self.counts_path)
+        self.flushed = time.monotonic() if now is None else now
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.log.close()
+            self.index.close()
+
+
+def read_counts(path):
+    """The counts of records by level in the file at `path`, if any."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class RunLogHandler(logging.Handler):
+    """Writes each record to the log of its run, opened on demand."""
+
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self._logs = {}
+
+    def emit(self, record):
+        folder = getattr(record, "run", None)
+        if folder is None:
+            return
+        try:
+            runlog = self._logs.get(folder)
+            if runlog is None:
+                runlog = self._logs[folder] = _RunLog(folder)
+            runlog.write(record)
+        except Exception:
+            self.handleError(record)
+
+    def close_run(self, folder):
+        runlog = self._logs.pop(folder, None)
+        if runlog:
+            runlog.close()
+
+    def close(self):
+        for runlog in self._logs.values():
+            runlog.close()
+        self._logs.clear()
+        super().close()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def __init__(self, queue, run_handler, handlers):
+        super().__init__(queue, run_handler, *handlers, respect_handler_level=True)
+        self.run_handler = run_handler
+
+    def handle(self, record):
+        if isinstance(record, _End):
+            self.run_handler.close_run(record.folder)
+            record.written.set()
+        else:
+            super().handle(record)
+
+
+def install():
+    """Route the records of the root logger through a queue, in this process.
+
+    The handlers of the root logger are moved behind the queue, along with
+    the one writing the logs of the runs.
+    """
+    global _queue, _listener
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    _queue = queue.Queue()
+    queueh = logging.handlers.QueueHandler(_queue)
+    queueh.addFilter(_RunFilter())
+    root.addHandler(queueh)
+    root.setLevel(logging.DEBUG)
+    _listener = _Listener(_queue, RunLogHandler(), handlers)
+    _listener.start()
+
+
+def start(folder, level=logging.DEBUG, stage=None):
+    """Log the records of this process to the log of the run in `folder`.
+
+    Records below `level` are dropped before they are even formatted.
+    """
+    global _run, _level, _stage
+    if isinstance(level, str):
+        level = logging.getLevelName(level)
+    _run, _level, _stage = folder, level, stage
+    logging.getLogger().setLevel(_level)
+
+
+def stage(name):
+    """Tag the next records of the run with the stage `name`."""
+    global _stage
+    _stage = name
+
+
+def end(timeout=30):
+    """Stop logging to the log of the run, once all its records are written."""
+    global _run, _stage
+    folder, _run, _stage = _run, None, None
+    logging.getLogger().setLevel(logging.DEBUG)
+    if _queue is not None and folder is not None:
+        record = _End(folder)
+        _queue.put(record)
+        record.written.wait(timeout)
@@ -0,0 +1,293 @@
+"""The co2mpas run pipeline, executed by the :class:`jobs.JobExecutor` workers.
+
+co2mpas, and the scientific stack below it, is imported on first use only,
+so that the web pages not simulating anything are served right away.
+"""
+
+import contextlib
+import fnmatch
+import functools
+import glob
+import logging
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+from co2wui import cache, runlog, timings
+
+log = logging.getLogger(__name__)
+
+#: Sub-folder of a split run, holding the results of each input file.
+PARTS_FOLDER = ".parts"
+
+#: The options of the simulation form, with their labels.
+FLAGS = {
+    "tamode": "Type approval mode",
+    "declaration_mode": "Declaration mode",
+    "hard_validation": "Hard validation",
+    "only_summary": "Only summary",
+    "split_inputs": "Files in parallel",
+}
+
+#: The nodes of the co2mpas dispatcher parsing the input workbooks.
+PARSE_NODES = ("parse_excel_file",)
+
+#: The nodes of the co2mpas dispatcher building the core model, afresh at
+#: each run, where the input workbooks are parsed.
+CORE_NODES = ("register_core",)
+
+#: The rows of the headers of the sheets of the summary written by co2mpas:
+#: a level of the columns per row (cycle, stage, usage, parameter and unit),
+#: then the names of the index, by vehicle and input file.
+SUMMARY_HEADER_ROWS = {"summary": 6, "proc_info": 1}
+
+#: The co2mpas dispatcher of this process, built once by :func:`dispatcher`.
+_dispatcher = None
+
+#: Seconds taken to build the dispatcher, once built.
+build_time = None
+
+#: Held while building the dispatcher, e.g. in the background.
+_lock = threading.Lock()
+
+#: Times the stages and the dispatcher nodes of the run of this process.
+_profiler = timings.Profiler()
+
+
+def version():
+    """The version of co2mpas, importing it."""
+    import co2mpas
+
+    return co2mpas.__version__
+
+
+def _prepare(dsp, parsed):
+    # Also the dispatchers built by the nodes while running, e.g. the model
+    for node_id in CORE_NODES:
+        attrs = dsp.nodes.get(node_id)
+        fn = attrs and attrs.get("function")
+        if fn is not None and not getattr(fn, "_prepares", False):
+            attrs["function"] = _preparing(fn, parsed)
+    cache.memoize_parsers(dsp, PARSE_NODES, parsed)
+    timings.instrument(dsp, _profiler)
+
+
+def _preparing(fn, parsed):
+    @functools.wraps(fn)
+    def build(*args, **kwargs):
+        built = fn(*args, **kwargs)
+        if hasattr(built, "nodes"):
+            _prepare(built, parsed)
+        return built
+
+    build._prepares = True
+    return build
+
+
+def dispatcher():
+    """The co2mpas dispatcher, built on first use and reused afterwards.
+
+    Building it with ``dsp.register()`` takes seconds; call this in the web
+    process before the workers are forked, so they all inherit it.
+    """
+    global _dispatcher, build_time
+    with _lock:
+        if _dispatcher is None:
+            started = time.perf_counter()
+            from co2mpas import dsp
+
+            built = dsp.register()
+            # Workbooks are parsed once, whatever the flags of the runs
+            _prepare(built, cache.ParsedInputs(version()))
+            _dispatcher = built
+            build_time = time.perf_counter() - started
+            log.info("co2mpas dispatcher built in %.1f s.", build_time)
+    return _dispatcher
+
+
+def warm_up(background=False):
+    """Build the dispatcher, e.g. before forking the worker processes.
+
+    In the `background`, the thread building it is returned.
+    """
+    if not background:
+        return dispatcher()
+    thread = threading.Thread(target=dispatcher, name="co2mpas-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def init_worker():
+    """Initialize a worker process, routing the logs of its runs."""
+    runlog.install()
+    dispatcher()
+
+
+def output_folder(run_id):
+    return osp.join("output", run_id)
+
+
+@contextlib.contextmanager
+def _stage(name):
+    # Tags the log records, and times the stage
+    runlog.stage(name)
+    with _profiler.timed(name):
+        yield
+
+
+def run_process(run_id, args, files, part=None, results=None):
+    """Run co2mpas on the input `files`, in the output folder of `run_id`.
+
+    With a `part` number, results are written in a sub-folder instead,
+    to be collected by :func:`merge_parts` once all parts are done.
+    With a :class:`cache.ResultCache` as `results`, the results of an
+    identical run are reused, and new ones are stored.
+    The time taken by each stage and node is saved in its profile.
+    """
+    run_folder = output_folder(run_id)
+    folder = run_folder
+    if part is not None:
+        folder = osp.join(run_folder, PARTS_FOLDER, str(part))
+
+    # Create output directory for this execution
+    os.makedirs(folder, exist_ok=True)
+
+    # Dedicated logging and profile for this run
+    level = args.get("log_level")
+    runlog.start(run_folder, level if level in runlog.LEVELS else "INFO")
+    _profiler.start(run_id if part is None else "part %d" % part)
+    try:
+        return _simulate(folder, args, files, results)
+    except Exception:
+        log.exception("Simulation failed.")
+        raise
+    finally:
+        timings.save(_profiler.stop(), osp.join(folder, timings.PROFILE))
+        runlog.end()
+
+
+def _simulate(folder, args, files, results):
+    # Input parameters
+    kwargs = {
+        "output_folder": folder,
+        "only_summary": bool(args.get("only_summary")),
+        "hard_validation": bool(args.get("hard_validation")),
+        "declaration_mode": bool(args.get("declaration_mode")),
+        "encryption_keys": "",
+        "sign_key": "",
+        "encryption_keys_passwords": "",
+        "enable_selector": False,
+        "type_approval_mode": bool(args.get("tamode")),
+    }
+
+    inputs = dict(
+        plot_workflow=False,
+        host="127.0.0.1",
+        port=4999,
+        cmd_flags=kwargs,
+        input_files=files,
+    )
+
+    if results is not None:
+        with _stage("inputs"):
+            # Inputs and flags
+            flags = {k: v for k, v in kwargs.items() if k != "output_folder"}
+            key = cache.result_key(files, flags, version())
+            if results.get(key, folder) is not None:
+                log.warning("Results of an identical run reused (%s).", key)
+                return ""
+    before = set(os.listdir(folder)) | {runlog.LOGFILE, runlog.INDEX, timings.PROFILE}
+
+    # Dispatcher
+    with _stage("simulation"):
+        ret = dispatcher().dispatch(inputs, ["done", "run"])
+
+    with _stage("results"):
+        with open(osp.join(folder, "result.dat"), "w+") as f:
+            f.write(str(ret))
+        if results is not None:
+            new = set(os.listdir(folder)) - before
+            counts = fnmatch.filter(new, runlog.COUNTS % "*" + "*")  # or being written
+            results.put(key, folder, sorted(new.difference(counts)))
+    return ""
+
+
+def merge_parts(run_id):
+    """Collect the results of the parts of a split run into its output folder.
+
+    The summaries of the parts are merged into a single workbook.
+    """
+    run_folder = output_folder(run_id)
+    runlog.start(run_folder, "INFO", "merge")
+    _profiler.start("merge")
+    try:
+        profiles = _merge(run_folder)
+    except Exception:
+        log.exception("Merging the results failed.")
+        raise
+    finally:
+        merged = _profiler.stop()
+        runlog.end()
+
+    # The parts ran in parallel, then were merged
+    profile = timings.merge(run_id, profiles)
+    profile["children"].append(merged)
+    profile["wall"] += merged["wall"]
+    profile["cpu"] += merged["cpu"]
+    timings.save(profile, osp.join(run_folder, timings.PROFILE))
+    return ""
+
+
+def _merge(run_folder):
+    parts = sorted(
+        glob.glob(osp.join(run_folder, PARTS_FOLDER, "*")),
+        key=lambda p: int(osp.basename(p)),
+    )
+
+    results, summaries, profiles = [], [], []
+    for part in parts:
+        for fpath in sorted(glob.glob(osp.join(part, "*"))):
+            fname = osp.basename(fpath)
+            if fname == "result.dat":
+                with open(fpath) as f:
+                    results.append(f.read())
+            elif fname == timings.PROFILE:
+                profiles.append(timings.load(fpath))
+            elif fnmatch.fnmatch(fname, "*summary.xls*"):
+                summaries.append(fpath)
+            else:
+                dst = osp.join(run_folder, fname)
+                if osp.exists(dst):
+                    dst = osp.join(run_folder, "%s-%s" % (osp.basename(part), fname))
+                shutil.move(fpath, dst)
+
+    if summaries:
+        merge_summaries(summaries, osp.join(run_folder, osp.basename(summaries[0])))
+    with open(osp.join(run_folder, "result.dat"), "w+") as f:
+        f.write("\n".join(results))
+    shutil.rmtree(osp.join(run_folder, PARTS_FOLDER))
+    return profiles
+
+
+def merge_summaries(files, dst):
+    """Concatenate, sheet by sheet, the rows of co2mpas summary workbooks.
+
+    The header rows repeated in every workbook, as many as in
+    :data:`SUMMARY_HEADER_ROWS`, are kept only once.
+    """
+    import pandas as pd
+
+    books = [pd.read_excel(f, sheet_name=None, header=None) for f in files]
+    names = []
+    for book in books:
+        names.extend(name for name in book if name not in names)
+
+    with pd.ExcelWriter(dst) as writer:
+        for name in names:
+            sheets = [book[name] for book in books if name in book]
+            header = SUMMARY_HEADER_ROWS.get(name, 0)
+            frames = [sheets[0]]
+            frames.extend(df.iloc[header:] for df in sheets[1:])
+            df = pd.concat(frames, ignore_index=True)
+            df.to_excel(writer, sheet_name=name, header=False, index=False)
@@ -0,0 +1,413 @@
+"""Persistent registry of the runs, in an SQLite database.
+
+Keeps the state, timestamps, flags and outcome of every run submitted, so
+they can be looked up by id in constant time, and across restarts; and the
+catalog of their results, indexed when each run is over.
+"""
+
+import contextlib
+import json
+import os
+import os.path as osp
+import sqlite3
+import threading
+import time
+
+from co2wui import jobs
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    flags TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    lease REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_submitted ON jobs (submitted);
+
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT PRIMARY KEY,
+    indexed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    UNIQUE (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    run_id TEXT PRIMARY KEY,
+    last REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    claimed REAL,
+    checked REAL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    runs INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO sweeps (id) VALUES (0);
+CREATE TABLE IF NOT EXISTS cancels (
+    run_id TEXT PRIMARY KEY,
+    requested REAL NOT NULL
+);
+"""
+
+_COLUMNS = ("id", "state", "submitted", "started", "finished", "flags", "error")
+
+
+class JobStore(object):
+    """The jobs stored in the SQLite database at `path`.
+
+    The database is created, if missing, once first used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._created = False
+        self._lock = threading.Lock()
+
+    def _create(self, db):
+        db.executescript(_SCHEMA)
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        if "lease" not in columns:
+            # Databases predating the leases of the jobs
+            try:
+                db.execute("ALTER TABLE jobs ADD COLUMN lease REAL")
+            except sqlite3.OperationalError:
+                pass  # added meanwhile by another process
+
+    @property
+    def _db(self):
+        # SQLite connections cannot be shared among threads, nor with the
+        # processes forked after opening them, e.g. web workers
+        if self._pid != os.getpid():
+            self._pid, self._local = os.getpid(), threading.local()
+        db = getattr(self._local, "db", None)
+        if db is None:
+            with self._lock:
+                if not self._created:
+                    os.makedirs(osp.dirname(self.path) or ".", exist_ok=True)
+                db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL")
+                if not self._created:
+                    self._create(db)
+                    self._created = True
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def add(self, job):
+        """Register a new `job`; raise :class:`KeyError` if its id is taken.
+
+        The calling process, supposed to run the job, holds its lease
+        for :data:`jobs.LEASE` seconds, to :meth:`renew` meanwhile.
+        """
+        try:
+            self._db.execute(
+                "INSERT INTO jobs (%s, lease) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                % ", ".join(_COLUMNS),
+                self._row(job) + (time.time() + jobs.LEASE,),
+            )
+        except sqlite3.IntegrityError:
+            raise KeyError(job.id)
+
+    def save(self, job):
+        """Store the current state of a registered `job`."""
+        self._db.execute(
+            "UPDATE jobs SET %s WHERE id = ?"
+            % ", ".join("%s = ?" % c for c in _COLUMNS[1:]),
+            self._row(job)[1:] + (job.id,),
+        )
+
+    def get(self, job_id):
+        """The :class:`jobs.Job` with `job_id`, or ``None``."""
+        row = self._db.execute(
+            "SELECT %s FROM jobs WHERE id = ?" % ", ".join(_COLUMNS), (job_id,)
+        ).fetchone()
+        return row and self._job(row)
+
+    def count(self, state):
+        """The number of jobs in `state`."""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)
+        ).fetchone()[0]
+
+    def renew(self, run_ids, now=None):
+        """Extend the leases of the jobs `run_ids`, still run by this process."""
+        now = time.time() if now is None else now
+        run_ids = list(run_ids)
+        self._db.execute(
+            "UPDATE jobs SET lease = ? WHERE id IN (%s)"
+            % ", ".join("?" * len(run_ids)),
+            [now + jobs.LEASE] + run_ids,
+        )
+
+    def interrupt(self, now=None):
+        """Fail the unfinished jobs whose lease expired, e.g. of processes gone.
+
+        Those of the processes still running, e.g. other web workers or a
+        batch sharing the database, are renewed by them, and left alone.
+        Returns the number of jobs failed.
+        """
+        now = time.time() if now is None else now
+        return self._db.execute(
+            "UPDATE jobs SET state = ?, finished = ?, error = ? "
+            "WHERE state IN (?, ?) AND (lease IS NULL OR lease < ?)",
+            (jobs.FAILED, now, "Interrupted", jobs.QUEUED, jobs.RUNNING, now),
+        ).rowcount
+
+    def unfinished(self):
+        """The jobs queued or running, in order of submission."""
+        rows = self._db.execute(
+            "SELECT %s FROM jobs WHERE state IN (?, ?) ORDER BY submitted, id"
+            % ", ".join(_COLUMNS),
+            (jobs.QUEUED, jobs.RUNNING),
+        ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def request_cancel(self, run_id):
+        """Ask the process running the job `run_id` to cancel it.
+
+        Returns whether the job is unfinished.
+        """
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO cancels (run_id, requested) "
+            "SELECT id, ? FROM jobs WHERE id = ? AND state IN (?, ?)",
+            (time.time(), run_id, jobs.QUEUED, jobs.RUNNING),
+        )
+        if cursor.rowcount:
+            return True
+        return bool(
+            self._db.execute(
+                "SELECT 1 FROM cancels WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        )
+
+    def pop_cancels(self, run_ids):
+        """Those of `run_ids` requested to be cancelled, forgetting requests."""
+        run_ids = list(run_ids)
+        # Polled often: read only, unless some are found
+        found = {
+            r[0]
+            for r in self._db.execute(
+                "SELECT run_id FROM cancels WHERE run_id IN (%s)"
+                % ", ".join("?" * len(run_ids)),
+                run_ids,
+            )
+        }
+        if found:
+            self._db.executemany(
+                "DELETE FROM cancels WHERE run_id = ?", [(r,) for r in found]
+            )
+        return found
+
+    def index_run(self, run_id, folder, names):
+        """Catalog the result files `names` of the run, found in `folder`.
+
+        Returns their total size.
+        """
+        files = [(run_id, n, osp.getsize(osp.join(folder, n))) for n in names]
+        with self._transaction() as db:
+            db.execute("DELETE FROM files WHERE run_id = ?", (run_id,))
+            db.executemany(
+                "INSERT INTO files (run_id, name, size) VALUES (?, ?, ?)", files
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO results (run_id, indexed) VALUES (?, ?)",
+                (run_id, time.time()),
+            )
+        return sum(size for _, _, size in files)
+
+    def results_size(self):
+        """The total size of the cataloged result files."""
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[
+            0
+        ]
+
+    def get_file(self, file_id):
+        """The ``(run_id, name, size)`` of a cataloged file, or ``None``."""
+        return self._db.execute(
+            "SELECT run_id, name, size FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
+
+    def sync(self, folder, listdir):
+        """Catalog the runs in `folder` missing from the index, e.g. older ones.
+
+        Only the run folders not yet indexed are listed with `listdir`.
+        """
+        indexed = {r[0] for r in self._db.execute("SELECT run_id FROM results")}
+        for entry in os.scandir(folder):
+            if not entry.is_dir() or entry.name in indexed:
+                continue
+            job = self.get(entry.name)
+            if job is None:
+                # Predating the job store
+                job = jobs.Job(entry.name)
+                job.state = jobs.FINISHED
+                job.submitted = job.started = job.finished = entry.stat().st_ctime
+                self.add(job)
+            if job.done:
+                self.index_run(entry.name, entry.path, listdir(entry.path))
+
+    def touch(self, run_id):
+        """Record that the results of the run were just downloaded."""
+        self._db.execute(
+            "INSERT OR REPLACE INTO downloads (run_id, last) VALUES (?, ?)",
+            (run_id, time.time()),
+        )
+
+    def by_last_use(self):
+        """The ``(run_id, last_used, finished)`` of the cataloged runs.
+
+        Runs are last used when their results were last downloaded, or
+        else when they finished; the least recently used come first.
+        """
+        return self._db.execute(
+            "SELECT results.run_id, COALESCE(downloads.last, jobs.finished, "
+            "results.indexed) AS used, COALESCE(jobs.finished, results.indexed) "
+            "FROM results LEFT JOIN jobs ON jobs.id = results.run_id "
+            "LEFT JOIN downloads ON downloads.run_id = results.run_id "
+            "ORDER BY used, results.run_id"
+        ).fetchall()
+
+    def claim_sweep(self, interval, now=None):
+        """Whether to sweep the runs, not swept by any process for `interval`."""
+        now = time.time() if now is None else now
+        return bool(
+            self._db.execute(
+                "UPDATE sweeps SET claimed = ? WHERE claimed IS NULL OR claimed <= ?",
+                (now, now - interval),
+            ).rowcount
+        )
+
+    def set_usage(self, size, runs, checked):
+        """Record the `size` and number of the runs, as of the sweep `checked`."""
+        self._db.execute(
+            "UPDATE sweeps SET bytes = ?, runs = ?, checked = ?", (size, runs, checked)
+        )
+
+    def reduce_usage(self, size, runs):
+        """Record that `runs` runs of `size` bytes were removed since the sweep."""
+        self._db.execute(
+            "UPDATE sweeps SET bytes = MAX(bytes - ?, 0), runs = MAX(runs - ?, 0)",
+            (size, runs),
+        )
+
+    def usage(self):
+        """The ``bytes`` and ``runs`` as of the last sweep, ``checked`` then."""
+        size, runs, checked = self._db.execute(
+            "SELECT bytes, runs, checked FROM sweeps"
+        ).fetchone()
+        return {"bytes": size, "runs": runs, "checked": checked}
+
+    def delete(self, run_ids):
+        """Forget the runs `run_ids`, and their results."""
+        params = [(run_id,) for run_id in run_ids]
+        with self._transaction() as db:
+            for table, column in (
+                ("jobs", "id"),
+                ("results", "run_id"),
+                ("files", "run_id"),
+                ("downloads", "run_id"),
+                ("cancels", "run_id"),
+            ):
+                db.executemany("DELETE FROM %s WHERE %s = ?" % (table, column), params)
+
+    def find(
+        self,
+        since=None,
+        until=None,
+        state=None,
+        flags=(),
+        sort="submitted",
+        descending=True,
+        offset=0,
+        limit=50,
+    ):
+        """A page of the cataloged runs matching the filters, with their files.
+
+        Runs are filtered by submission time in ``[since, until)``, `state`,
+        and `flags` set; `sort` is a column of the jobs.
+        Returns a list of ``(job, files)``, with `files` a list of
+        ``(file_id, name, size)``.
+        """
+        if sort not in _COLUMNS:
+            raise ValueError("Cannot sort by %r" % sort)
+        where, params = [], []
+        if since is not None:
+            where.append("jobs.submitted >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("jobs.submitted < ?")
+            params.append(until)
+        if state is not None:
+            where.append("jobs.state = ?")
+            params.append(state)
+        for flag in flags:
+            # A non-empty value in the (sorted) JSON of the flags
+            where.append("jobs.flags GLOB ?")
+            params.append('*"%s": "[^"]*' % flag)
+
+        rows = self._db.execute(
+            "SELECT %s FROM jobs JOIN results ON results.run_id = jobs.id %s "
+            "ORDER BY jobs.%s %s, jobs.id LIMIT ? OFFSET ?"
+            % (
+                ", ".join("jobs." + c for c in _COLUMNS),
+                "WHERE " + " AND ".join(where) if where else "",
+                sort,
+                "DESC" if descending else "ASC",
+            ),
+            params + [limit, offset],
+        ).fetchall()
+
+        jobs_found = [self._job(row) for row in rows]
+        files = self.get_files([job.id for job in jobs_found])
+        return [(job, files[job.id]) for job in jobs_found]
+
+    def get_files(self, run_ids):
+        """The ``(file_id, name, size)`` of the files of each of `run_ids`."""
+        files = {run_id: [] for run_id in run_ids}
+        for file_id, run_id, name, size in self._db.execute(
+            "SELECT id, run_id, name, size FROM files WHERE run_id IN (%s) "
+            "ORDER BY id" % ", ".join("?" * len(files)),
+            list(files),
+        ):
+            files[run_id].append((file_id, name, size))
+        return files
+
+    @staticmethod
+    def _row(job):
+        return (
+            job.id,
+            job.state,
+            job.submitted,
+            job.started,
+            job.finished,
+            json.dumps(job.flags, sort_keys=True),
+            job.error,
+        )
+
+    @staticmethod
+    def _job(row):
+        job = jobs.Job(row[0])
+        job.state, job.submitted, job.started, job.finished = row[1:5]
+        job.flags, job.error = json.loads(row[5]), row[6]
+        return job
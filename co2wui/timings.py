@@ -0,0 +1,186 @@
+"""Timing of the stages of a run and of the nodes of the co2mpas dispatcher.
+
+The functions of the dispatcher, and of its sub-dispatchers, are wrapped
+once per process to time their calls, while a :class:`Profiler` records.
+Calls are aggregated by their path in the call tree, with their wall and
+CPU time, so the profile of a run stays small however many calls it makes.
+"""
+
+import contextlib
+import functools
+import json
+import threading
+import time
+
+PROFILE = "profile.json"
+
+
+class _Node(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.children = {}
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = _Node(name)
+        return node
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "children": [c.to_dict() for c in self.children.values()],
+        }
+
+
+class Profiler(object):
+    """Records the call tree of the timed stages and nodes, while started."""
+
+    def __init__(self):
+        self.root = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main = None
+        self._start = None
+
+    @property
+    def active(self):
+        return self.root is not None
+
+    def start(self, name):
+        """Start recording the profile of the run `name`."""
+        self.root = self._local.root = _Node(name)
+        self._main = self._local.stack = [self.root]
+        self._start = time.perf_counter(), time.process_time()
+
+    def stop(self):
+        """Stop recording, and return the profile as a dict."""
+        root, self.root = self.root, None
+        wall, cpu = self._start
+        root.calls = 1
+        root.wall = time.perf_counter() - wall
+        root.cpu = time.process_time() - cpu
+        self._main = None
+        return root.to_dict()
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """Time the calls within as those of the node `name`."""
+        root = self.root
+        if root is None:
+            yield
+            return
+        if getattr(self._local, "root", None) is not root:
+            # Threads of the dispatcher continue the call tree of the run
+            self._local.root = root
+            self._local.stack = [(self._main or [root])[-1]]
+        stack = self._local.stack
+        with self._lock:
+            node = stack[-1].child(name)
+        stack.append(node)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            stack.pop()
+            with self._lock:
+                node.calls += 1
+                node.wall += wall
+                node.cpu += cpu
+
+
+def _timed_function(fn, name, profiler):
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        with profiler.timed(name):
+            return fn(*args, **kwargs)
+
+    timed._profiled = True
+    return timed
+
+
+def _time_calls(obj, name, profiler):
+    # Sub-dispatchers are checked by type, hence timed by a subclass of theirs
+    cls = type(obj)
+
+    def __call__(self, *args, **kwargs):
+        with profiler.timed(name):
+            return cls.__call__(self, *args, **kwargs)
+
+    obj.__class__ = type(
+        cls.__name__, (cls,), {"__call__": __call__, "_profiled": True}
+    )
+
+
+def instrument(dsp, profiler, _seen=None):
+    """Time with `profiler` the function nodes of `dsp` and of its sub-dispatchers."""
+    seen = set() if _seen is None else _seen
+    if id(dsp) in seen:
+        return
+    seen.add(id(dsp))
+    for node_id, attrs in dsp.nodes.items():
+        fn = attrs.get("function")
+        if fn is None or attrs.get("type") not in ("function", "dispatcher"):
+            continue
+        sub = getattr(fn, "dsp", None)
+        if sub is not None and hasattr(sub, "nodes"):
+            instrument(sub, profiler, seen)
+        if getattr(fn, "_profiled", False):
+            continue
+        name = str(node_id)
+        if sub is not None:
+            try:
+                _time_calls(fn, name, profiler)
+                continue
+            except TypeError:
+                pass  # not a python class
+        attrs["function"] = _timed_function(fn, name, profiler)
+
+
+def merge(name, profiles):
+    """A profile of `name`, of the `profiles` run in parallel."""
+    return {
+        "name": name,
+        "calls": 1,
+        "wall": max([p["wall"] for p in profiles] or [0.0]),
+        "cpu": sum(p["cpu"] for p in profiles),
+        "children": profiles,
+    }
+
+
+def hotspots(profile, n=20):
+    """The `n` nodes of a `profile` taking the most time by themselves.
+
+    Returns a list of ``(path, calls, wall, self_wall, cpu)``, with the
+    ``self_wall`` time spent in the node but not in its children.
+    """
+    rows = []
+
+    def visit(node, path):
+        path = path + (node["name"],)
+        children = node["children"]
+        own = node["wall"] - sum(c["wall"] for c in children)
+        rows.append((path, node["calls"], node["wall"], max(own, 0.0), node["cpu"]))
+        for child in children:
+            visit(child, path)
+
+    visit(profile, ())
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows[:n]
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(profile, path):
+    with open(path, "w") as f:
+        json.dump(profile, f)
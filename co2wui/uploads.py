@@ -0,0 +1,215 @@
+"""Chunked, resumable uploads of the input files.
+
+Each file is streamed to disk chunk by chunk, hashed as it arrives, and
+moved among the inputs only when complete.  An interrupted upload resumes
+from the bytes already received, and its digest is kept with the input,
+so that it is never read again just to hash it.
+"""
+
+import hashlib
+import io
+import json
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+import uuid
+
+from co2wui import cache
+
+try:
+    import fcntl
+except ImportError:  # on Windows
+    fcntl = None
+
+CHUNK_SIZE = 1 << 16
+
+#: Bytes of a form besides its file, e.g. the boundaries of its parts.
+FORM_OVERHEAD = 1 << 16
+
+
+class UploadError(Exception):
+    """A rejected upload, answered with the HTTP `status`."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Uploads(object):
+    """The uploads in progress in `folder`, of files for the `inputs` folder.
+
+    Files larger than `max_size` bytes are refused.
+    """
+
+    def __init__(self, folder, inputs, max_size):
+        self.folder = folder
+        self.inputs = inputs
+        self.max_size = max_size
+        #: The hash of the bytes received so far, by upload id.
+        self._hashes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _path(self, upload_id, ext):
+        return osp.join(self.folder, upload_id + ext)
+
+    def _upload_lock(self, upload_id):
+        # Chunks of the same upload are written one at a time
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def start(self, name, size, sha256=None, modified=None):
+        """Begin, or resume, the upload of a file.
+
+        The same `name`, `size`, `sha256` and `modified` time resume the same
+        upload.  Returns ``(upload_id, offset, done)``, with `offset` the
+        bytes already received.
+        """
+        if not name:
+            raise UploadError("Invalid file name")
+        if size < 0 or size > self.max_size:
+            raise UploadError("The file exceeds %d bytes" % self.max_size, 413)
+        meta = {"name": name, "size": size, "sha256": sha256, "modified": modified}
+        data = json.dumps(meta, sort_keys=True)
+        upload_id = hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+        os.makedirs(self.folder, exist_ok=True)
+        with self._upload_lock(upload_id):
+            if not osp.isfile(self._path(upload_id, ".json")):
+                with open(self._path(upload_id, ".part"), "wb"):
+                    pass
+                with open(self._path(upload_id, ".json"), "w") as f:
+                    f.write(data)
+        if size == 0:
+            self.write(upload_id, 0, io.BytesIO())
+            return upload_id, 0, True
+        return upload_id, self.offset(upload_id), False
+
+    def _meta(self, upload_id):
+        try:
+            with open(self._path(upload_id, ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", 404)
+
+    def offset(self, upload_id):
+        """The bytes received so far by the upload."""
+        try:
+            return osp.getsize(self._path(upload_id, ".part"))
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", 404)
+
+    def _hash(self, upload_id, offset):
+        # Only after a restart the received bytes are read again
+        received, h = self._hashes.pop(upload_id, (None, None))
+        if received != offset:
+            h = hashlib.sha256()
+            with open(self._path(upload_id, ".part"), "rb") as f:
+                for chunk in iter(lambda: f.read(cache.CHUNK_SIZE), b""):
+                    h.update(chunk)
+        return h
+
+    def write(self, upload_id, offset, stream):
+        """Append the bytes of `stream` at `offset` of the upload.
+
+        The `offset` must be the bytes received so far.  Returns
+        ``(offset, done)``; once all bytes are received, the file is
+        checked and moved among the inputs.
+        """
+        with self._upload_lock(upload_id):
+            meta = self._meta(upload_id)
+            with open(self._path(upload_id, ".part"), "ab") as f:
+                if fcntl:
+                    # Chunks may reach other processes too, e.g. web workers
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                received = f.seek(0, os.SEEK_END)
+                if offset != received:
+                    raise UploadError("Upload at %d bytes" % received, 409)
+                h = self._hash(upload_id, offset)
+                try:
+                    left = meta["size"] - offset
+                    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                        if len(chunk) > left:
+                            raise UploadError("More bytes than declared", 413)
+                        f.write(chunk)
+                        h.update(chunk)
+                        offset += len(chunk)
+                        left -= len(chunk)
+                finally:
+                    self._hashes[upload_id] = offset, h
+
+            if offset < meta["size"]:
+                return offset, False
+            del self._hashes[upload_id]
+            self._finish(upload_id, meta, h.hexdigest())
+        return offset, True
+
+    def _finish(self, upload_id, meta, digest):
+        part = self._path(upload_id, ".part")
+        os.remove(self._path(upload_id, ".json"))
+        with self._lock:
+            self._locks.pop(upload_id, None)
+        if meta["sha256"] and meta["sha256"].lower() != digest:
+            os.remove(part)
+            raise UploadError("The file is corrupted, upload it again", 422)
+        dst = osp.join(self.inputs, meta["name"])
+        shutil.move(part, dst)
+        cache.record_digest(dst, digest)
+
+    def check_form(self, length):
+        """Refuse a form of `length` bytes, before parsing it to disk."""
+        if length is None:
+            raise UploadError("The length of the upload is required", 411)
+        if length > self.max_size + FORM_OVERHEAD:
+            raise UploadError("The file exceeds %d bytes" % self.max_size, 413)
+
+    def save(self, name, stream):
+        """Upload at once the file `name`, from the `stream` of its content."""
+        upload_id = self.start(name, self.max_size, modified=uuid.uuid4().hex)[0]
+        try:
+            offset, done = self.write(upload_id, 0, stream)
+        except UploadError:
+            self.discard(upload_id)
+            raise
+        if not done:
+            # The size was not declared, finish with the bytes received
+            with self._upload_lock(upload_id):
+                h = self._hashes.pop(upload_id)[1]
+                meta = dict(self._meta(upload_id), size=offset)
+                self._finish(upload_id, meta, h.hexdigest())
+
+    def sweep(self, max_age, now=None):
+        """Drop the uploads left unfinished, not written for `max_age` seconds.
+
+        Returns their ids.
+        """
+        now = time.time() if now is None else now
+        stale = []
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            return stale
+        for entry in entries:
+            upload_id, ext = osp.splitext(entry.name)
+            if ext != ".json":
+                continue
+            try:
+                written = os.stat(self._path(upload_id, ".part")).st_mtime
+            except FileNotFoundError:
+                written = entry.stat().st_mtime
+            if written < now - max_age:
+                self.discard(upload_id)
+                stale.append(upload_id)
+        return stale
+
+    def discard(self, upload_id):
+        """Drop an unfinished upload."""
+        with self._upload_lock(upload_id):
+            self._hashes.pop(upload_id, None)
+            for ext in (".part", ".json"):
+                try:
+                    os.remove(self._path(upload_id, ext))
+                except FileNotFoundError:
+                    pass
@@ -7,13 +7,14 @@ setup(
     license="EUPL",
     long_description=open("README.md").read(),
     install_requires=["co2mpas", "Flask", "requests", "schedula", "Werkzeug"],
-    extras={
+    extras_require={
         "dev": [
             "black",  # for code-formatting
             "pip",
             "pre-commit",  # for code-formatting
             "wheel",
-        ]
+        ],
+        "serve": ["brotli", "gunicorn"],
     },
     entry_points={"console_scripts": ["co2wui=co2wui.app:cli"]},
 )
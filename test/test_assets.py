@@ -0,0 +1,82 @@
+import gzip
+import os
+import os.path as osp
+import tempfile
+import unittest
+
+from co2wui import assets
+
+BUNDLES = {
+    "js/app.js": ["lib/a.js", "lib/b.js"],
+    "css/app.css": ["lib/css/a.css", "css/b.css"],
+}
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.static = osp.join(self.tmpdir.name, "static")
+        self.folder = osp.join(self.tmpdir.name, "assets")
+        self._write("lib/a.js", b"var a = 1\n//# sourceMappingURL=a.map\n")
+        self._write("lib/b.js", b"var b = 2;" * 100)
+        self._write("lib/css/a.css", b"a{background:url('../img/x.png?v=1#y')}")
+        self._write("css/b.css", b"b{background:url(data:image/png;base64,AA==)}")
+        self._write("lib/img/x.png", b"png")
+        self._write("unused/c.js", b"var c;")
+
+    def _write(self, name, data):
+        path = osp.join(self.static, *name.split("/"))
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def _assets(self):
+        return assets.Assets(self.static, self.folder, BUNDLES, ["lib/img/x.png"])
+
+    def _read(self, name):
+        with open(osp.join(self.folder, *name.split("/")), "rb") as f:
+            return f.read()
+
+    def test_bundles(self):
+        ast = self._assets()
+        manifest = ast.build()
+        js = manifest["js/app.js"]
+        self.assertRegex(js, r"^js/app\.[0-9a-f]{12}\.js$")
+        self.assertEqual(ast.url("js/app.js"), "/static/" + js)
+        data = self._read(js)
+        self.assertTrue(data.startswith(b"var a = 1\n;\nvar b = 2;"))
+        self.assertNotIn(b"sourceMappingURL", data)
+
+        css = self._read(manifest["css/app.css"]).decode()
+        png = manifest["lib/img/x.png"]
+        self.assertIn("url('../%s?v=1#y')" % png, css)
+        self.assertIn("url(data:image/png;base64,AA==)", css)
+
+        # Rebuilt the same, until the sources change
+        self.assertEqual(self._assets().build(), manifest)
+        self._write("lib/b.js", b"var b = 3;" * 100)
+        self.assertNotEqual(self._assets().build()["js/app.js"], js)
+        self.assertFalse(osp.exists(osp.join(self.folder, js)))
+
+    def test_lookup(self):
+        ast = self._assets()
+        js = ast.build()["js/app.js"]
+        path = osp.join(self.folder, *js.split("/"))
+        found, encoding = ast.lookup(js, "gzip, deflate")
+        self.assertEqual((found, encoding), (path + ".gz", "gzip"))
+        with gzip.open(found) as f:
+            self.assertEqual(f.read(), self._read(js))
+        self.assertEqual(ast.lookup(js, "gzip;q=0"), (path, None))
+        self.assertEqual(ast.lookup(js), (path, None))
+
+        # Compressed already, or not worth it
+        png = ast.manifest["lib/img/x.png"]
+        self.assertIsNone(ast.lookup(png, "gzip")[1])
+
+        self.assertIsNone(ast.lookup("unused/c.js"))
+        self.assertIsNone(ast.lookup("lib/a.js"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import os.path as osp
+import tempfile
+import unittest
+
+from co2wui import batch, jobs, store
+
+
+def _simulate(run_id, args, files):
+    if "bad" in files[0]:
+        raise ValueError("bad input")
+    return run_id
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _touch(self, *names):
+        for name in names:
+            with open(osp.join(self.tmpdir.name, name), "w") as f:
+                f.write("x")
+
+    def test_find_inputs(self):
+        self._touch("a.xlsx", "b.xls", "c.txt")
+        os.mkdir(osp.join(self.tmpdir.name, "d.xlsx"))
+        names = lambda files: [osp.basename(f) for f in files]
+        self.assertEqual(
+            names(batch.find_inputs(self.tmpdir.name)), ["a.xlsx", "b.xls"]
+        )
+        pattern = osp.join(self.tmpdir.name, "*.xlsx")
+        self.assertEqual(names(batch.find_inputs(pattern)), ["a.xlsx"])
+
+    def test_run(self):
+        job_store = store.JobStore(osp.join(self.tmpdir.name, "jobs.db"))
+        indexed = []
+        runs = list(
+            batch.run(
+                ["a.xlsx", "bad.xlsx", "c.xlsx"],
+                _simulate,
+                {"tamode": "on"},
+                workers=2,
+                store=job_store,
+                on_done=lambda job: indexed.append(job.id),
+            )
+        )
+        self.assertEqual(sorted(f for f, _ in runs), ["a.xlsx", "bad.xlsx", "c.xlsx"])
+        self.assertCountEqual(indexed, [job.id for _, job in runs])
+        states = {f: job.state for f, job in runs}
+        self.assertEqual(states["bad.xlsx"], jobs.FAILED)
+        self.assertEqual(states["a.xlsx"], jobs.FINISHED)
+        stored = job_store.get(runs[0][1].id)
+        self.assertEqual(stored.flags, {"tamode": "on"})
+
+        report = batch.summary(runs, 10.0, 12.5)
+        self.assertEqual(report["wall"], 2.5)
+        self.assertEqual((report["total"], report["failed"]), (3, 1))
+        failed = [r for r in report["runs"] if r["error"]]
+        self.assertEqual([r["input"] for r in failed], ["bad.xlsx"])
+        self.assertIn("bad input", failed[0]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
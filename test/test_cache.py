@@ -0,0 +1,174 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+from co2wui import cache
+
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = cache.ContentCache(os.path.join(self.tmpdir.name, "cache"))
+
+    def _file(self, data):
+        path = self.cache.mkstemp()
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_put_lookup(self):
+        self.assertIsNone(self.cache.lookup("key"))
+        digest = self.cache.put(self._file(b"data"), "key")
+        self.assertEqual(digest, hashlib.sha256(b"data").hexdigest())
+        self.assertEqual(self.cache.lookup("key"), digest)
+        with open(self.cache.path(digest), "rb") as f:
+            self.assertEqual(f.read(), b"data")
+
+    def test_relink(self):
+        self.cache.put(self._file(b"old"), "key")
+        digest = self.cache.put(self._file(b"new"), "key")
+        self.assertEqual(self.cache.lookup("key"), digest)
+
+    def test_missing_blob(self):
+        digest = self.cache.put(self._file(b"data"), "key")
+        os.remove(self.cache.path(digest))
+        self.assertIsNone(self.cache.lookup("key"))
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = cache.ResultCache(os.path.join(self.tmpdir.name, "results"), 10)
+
+    def _run(self, name, **files):
+        folder = os.path.join(self.tmpdir.name, name)
+        os.makedirs(folder)
+        for fname, data in files.items():
+            with open(os.path.join(folder, fname), "wb") as f:
+                f.write(data)
+        return folder
+
+    def test_key(self):
+        src = self._run("in", **{"a.xlsx": b"a", "b.xlsx": b"a"})
+        a, b = os.path.join(src, "a.xlsx"), os.path.join(src, "b.xlsx")
+        key = cache.result_key([a], {"only_summary": True}, "3.0")
+        self.assertEqual(key, cache.result_key([a], {"only_summary": True}, "3.0"))
+        self.assertNotEqual(key, cache.result_key([b], {"only_summary": True}, "3.0"))
+        self.assertNotEqual(key, cache.result_key([a], {"only_summary": False}, "3.0"))
+        self.assertNotEqual(key, cache.result_key([a], {"only_summary": True}, "3.1"))
+
+    def test_put_get(self):
+        dst = self._run("dst")
+        self.assertIsNone(self.cache.get("key", dst))
+        src = self._run("src", **{"out.xlsx": b"out", "log.txt": b"log"})
+        self.cache.put("key", src, ["out.xlsx"])
+        self.assertEqual(self.cache.get("key", dst), ["out.xlsx"])
+        with open(os.path.join(dst, "out.xlsx"), "rb") as f:
+            self.assertEqual(f.read(), b"out")
+
+    def test_evict_lru(self):
+        for i, key in enumerate("abc"):
+            src = self._run(key, **{"out": b"1234"})
+            self.cache.put(key, src, ["out"])
+            os.utime(self.cache._entry(key), (i, i))
+            if key == "b":
+                self.cache.get("a", self._run("dst"))  # "a" used after "b"
+        self.assertIsNotNone(self.cache.get("a", self._run("dst-a")))
+        self.assertIsNone(self.cache.get("b", self._run("dst-b")))
+        self.assertIsNotNone(self.cache.get("c", self._run("dst-c")))
+
+
+class TestKnownDigest(unittest.TestCase):
+    def test_changed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "a.xlsx")
+            with open(path, "wb") as f:
+                f.write(b"old")
+            cache.record_digest(path, "stale")
+            self.assertEqual(cache.known_digest(path), "stale")
+            with open(path, "wb") as f:
+                f.write(b"new!")
+            self.assertEqual(
+                cache.known_digest(path), hashlib.sha256(b"new!").hexdigest()
+            )
+
+
+class _Dispatcher(object):
+    def __init__(self, **nodes):
+        self.nodes = nodes
+
+
+class _SubDispatch(object):
+    def __init__(self, dsp):
+        self.dsp = dsp
+
+
+def _nodes(parse):
+    inner = _Dispatcher(parse={"type": "function", "function": parse})
+    return _Dispatcher(
+        load={"type": "dispatcher", "function": _SubDispatch(inner)},
+        data={"type": "data"},
+    )
+
+
+class TestParsedInputs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "a.xlsx")
+        with open(self.path, "wb") as f:
+            f.write(b"workbook")
+        self.calls = []
+
+        def parse(input_file_name, input_file, sheet="all"):
+            self.calls.append(sheet)
+            return {"data": input_file.read(), "sheet": sheet}
+
+        self.parse = parse
+        self.dsp = _nodes(parse)
+
+    def _parse(self, dsp, *args, **kwargs):
+        fn = dsp.nodes["load"]["function"].dsp.nodes["parse"]["function"]
+        with open(self.path, "rb") as f:
+            return fn(self.path, f, *args, **kwargs)
+
+    def test_reused(self):
+        cache.memoize_parsers(self.dsp, ["parse"], cache.ParsedInputs("4.1"))
+        cache.memoize_parsers(self.dsp, ["parse"], cache.ParsedInputs("4.1"))
+        expected = {"data": b"workbook", "sheet": "all"}
+        self.assertEqual(self._parse(self.dsp), expected)
+        self.assertEqual(self._parse(self.dsp), expected)
+        self.assertEqual(self.calls, ["all"])
+
+        # By content, other arguments and version
+        self.assertEqual(self._parse(self.dsp, sheet="one")["sheet"], "one")
+        other = _nodes(self.parse)
+        cache.memoize_parsers(other, ["parse"], cache.ParsedInputs("4.2"))
+        self._parse(other)
+        with open(self.path, "wb") as f:
+            f.write(b"changed")
+        self.assertEqual(self._parse(self.dsp)["data"], b"changed")
+        self.assertEqual(self.calls, ["all", "one", "all", "all"])
+
+    def test_streams_not_keyed(self):
+        cache.memoize_parsers(self.dsp, ["parse"], cache.ParsedInputs("4.1"))
+        fn = self.dsp.nodes["load"]["function"].dsp.nodes["parse"]["function"]
+        for _ in range(2):
+            self.assertEqual(fn("a.xlsx", io.BytesIO(b"x"))["data"], b"x")
+        self.assertEqual(self.calls, ["all", "all"])
+
+    def test_discard(self):
+        parsed = cache.ParsedInputs("4.1")
+        parsed.put(self.path, "parse", {"data": 1})
+        self.assertEqual(parsed.get(self.path, "parse"), {"data": 1})
+        cache.discard_parsed(self.path)
+        with self.assertRaises(KeyError):
+            parsed.get(self.path, "parse")
+
+
+if __name__ == "__main__":
+    unittest.main()
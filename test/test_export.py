@@ -0,0 +1,44 @@
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+from co2wui import export
+
+
+class TestZipStream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.files = {}
+        for name, data in (("a.txt", b"a" * 100000), ("b.txt", os.urandom(1000))):
+            path = os.path.join(self.tmpdir.name, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            self.files[name] = path
+
+    def _archive(self, **kw):
+        entries = [("run/" + n, p) for n, p in sorted(self.files.items())]
+        entries.append(("run/missing.txt", os.path.join(self.tmpdir.name, "x")))
+        chunks = list(export.zip_stream(entries, chunk_size=4096, **kw))
+        self.assertGreater(len(chunks), 1)
+        return zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+    def _check(self, zf, compress_type):
+        self.assertIsNone(zf.testzip())
+        self.assertEqual(zf.namelist(), ["run/a.txt", "run/b.txt"])
+        for name, path in self.files.items():
+            with open(path, "rb") as f:
+                self.assertEqual(zf.read("run/" + name), f.read())
+            self.assertEqual(zf.getinfo("run/" + name).compress_type, compress_type)
+
+    def test_compressed(self):
+        self._check(self._archive(), zipfile.ZIP_DEFLATED)
+
+    def test_stored(self):
+        self._check(self._archive(compress=False), zipfile.ZIP_STORED)
+
+
+if __name__ == "__main__":
+    unittest.main()
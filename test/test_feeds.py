@@ -0,0 +1,47 @@
+import logging
+import tempfile
+import unittest
+
+from co2wui import feeds, jobs, runlog
+
+
+class TestFeed(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.folder = self.tmpdir.name
+        self.handler = runlog.RunLogHandler()
+        self.addCleanup(self.handler.close)
+        self.state = jobs.RUNNING
+        self.feeds = feeds.Feeds(interval=0.01)
+
+    def _log(self, level, msg):
+        record = logging.LogRecord("co2mpas", level, "", 0, msg, (), None)
+        record.run = self.folder
+        self.handler.handle(record)
+
+    def test_broadcast(self):
+        self._log(logging.WARNING, "old")
+        feed = self.feeds.get("run", self.folder, lambda: self.state)
+        self.assertIs(self.feeds.get("run", self.folder, None), feed)
+        (q1, offset, state), (q2, _, _) = feed.subscribe(), feed.subscribe()
+        self.assertEqual((offset, state), (runlog.ENTRY.size, jobs.RUNNING))
+        thread = feed._thread
+
+        self._log(logging.INFO, "hidden")
+        self._log(logging.WARNING, "new")
+        for q in (q1, q2):
+            event, start, end, lines = q.get(timeout=5)
+            self.assertEqual((event, start, end), ("log", offset, 3 * offset))
+            self.assertEqual(len(lines), 1)
+            self.assertTrue(lines[0].endswith(" - co2mpas - WARNING - new\n"))
+
+        self.state = jobs.FINISHED
+        for q in (q1, q2):
+            self.assertEqual(q.get(timeout=5), ("state", jobs.FINISHED))
+        thread.join(5)
+        self.assertIsNot(self.feeds.get("run", self.folder, lambda: 0), feed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import jinja2
+
+from co2wui import fragments
+
+TEMPLATES = {
+    "sidebar.html": '<li class="{{ data.active }}">{{ count() }}</li>',
+    "page.html": '{{ fragment("sidebar.html", data={"active": active}) }}',
+}
+
+
+class TestFragments(unittest.TestCase):
+    def _env(self, auto_reload=False):
+        env = jinja2.Environment(
+            loader=jinja2.DictLoader(TEMPLATES), auto_reload=auto_reload
+        )
+        calls = []
+        env.globals["count"] = lambda: calls.append(1) or len(calls)
+        self.fragments = fragments.Fragments(env)
+        env.globals["fragment"] = self.fragments.render
+        return env
+
+    def test_rendered_once(self):
+        page = self._env().get_template("page.html")
+        self.assertEqual(page.render(active="run"), '<li class="run">1</li>')
+        self.assertEqual(page.render(active="run"), '<li class="run">1</li>')
+        self.assertEqual(page.render(active=""), '<li class="">2</li>')
+        self.assertEqual(len(self.fragments), 2)
+
+    def test_auto_reload(self):
+        page = self._env(auto_reload=True).get_template("page.html")
+        page.render(active="run")
+        self.assertEqual(page.render(active="run"), '<li class="run">2</li>')
+        self.assertEqual(len(self.fragments), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from co2wui import jobs, store
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _fail():
+    raise ValueError("boom")
+
+
+_warm = False
+
+
+def _warm_up():
+    global _warm
+    _warm = True
+
+
+def _record(path):
+    with open(path, "a") as f:
+        f.write("%s %s\n" % (os.getpid(), _warm))
+
+
+def _append(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+
+class _FlakyStore(store.JobStore):
+    """A store failing once at each of `methods`."""
+
+    def __init__(self, path, *methods):
+        super().__init__(path)
+        for name in methods:
+            setattr(self, name, self._once(getattr(self, name)))
+
+    @staticmethod
+    def _once(method):
+        calls = []
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return method(*args)
+
+        return flaky
+
+
+def _wait(job, *states, timeout=10):
+    end = time.time() + timeout
+    while job.state not in (states or (jobs.FINISHED, jobs.FAILED)):
+        if time.time() > end:
+            raise AssertionError("job %s still %s" % (job.id, job.state))
+        time.sleep(0.01)
+
+
+class TestJobExecutor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.executor = jobs.JobExecutor(workers=1, queue_size=1)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=False)
+
+    def test_states(self):
+        job = self.executor.submit("a", _sleep, 0.3)
+        self.assertIs(self.executor.get("a"), job)
+        _wait(job, jobs.RUNNING)
+        _wait(job)
+        self.assertEqual(job.state, jobs.FINISHED)
+        self.assertLessEqual(job.submitted, job.started)
+        self.assertLessEqual(job.started, job.finished)
+
+    def test_failure(self):
+        job = self.executor.submit("a", _fail)
+        _wait(job)
+        self.assertEqual(job.state, jobs.FAILED)
+        self.assertIn("boom", job.error)
+
+    def test_submit_many(self):
+        job = self.executor.submit_many(
+            "a", _sleep, [(0,), (0,)], finalize=(_sleep, (0,))
+        )
+        _wait(job)
+        self.assertEqual(job.state, jobs.FINISHED)
+        self.assertEqual(job.pending, 0)
+
+    def test_submit_many_failure(self):
+        job = self.executor.submit_many("a", _sleep, [(0,), ("x",)], (_fail, ()))
+        _wait(job)
+        self.assertEqual(job.state, jobs.FAILED)
+        self.assertNotIn("boom", job.error)
+
+    def test_queue_full(self):
+        _wait(self.executor.submit("a", _sleep, 0.5), jobs.RUNNING)
+        self.executor.submit("b", _sleep, 0)
+        with self.assertRaises(jobs.QueueFull):
+            self.executor.submit("c", _sleep, 0)
+        self.assertIsNone(self.executor.get("c"))
+
+    def test_warm_recycled_workers(self):
+        self.executor.shutdown()
+        self.executor = jobs.JobExecutor(1, initializer=_warm_up, max_tasks=1)
+        path = os.path.join(self.tmpdir.name, "pids")
+        for i in range(2):
+            _wait(self.executor.submit(str(i), _record, path))
+        with open(path) as f:
+            lines = [line.split() for line in f]
+        self.assertEqual([warm for pid, warm in lines], ["True", "True"])
+        self.assertNotEqual(lines[0][0], lines[1][0])
+
+    def test_recycled_workers_busy(self):
+        self.executor.shutdown()
+        self.executor = jobs.JobExecutor(1, max_tasks=1)
+        # Submitted at once, the tasks are not sent to workers exiting
+        submitted = [self.executor.submit(str(i), _sleep, 0) for i in range(6)]
+        for job in submitted:
+            _wait(job)
+        self.assertEqual([job.state for job in submitted], [jobs.FINISHED] * 6)
+
+    def test_store(self):
+        self.executor.shutdown()
+        job_store = store.JobStore(os.path.join(self.tmpdir.name, "jobs.db"))
+        self.executor = jobs.JobExecutor(1, store=job_store)
+        job = self.executor.submit("a", _sleep, 0, flags={"tamode": "on"})
+        _wait(job)
+        # Dropped from memory once saved
+        end = time.time() + 10
+        while self.executor.get("a") is job and time.time() < end:
+            time.sleep(0.01)
+        self.assertIsNot(self.executor.get("a"), job)
+        self.assertEqual(self.executor.get("a").state, jobs.FINISHED)
+        self.assertEqual(job_store.get("a").flags, {"tamode": "on"})
+
+    def test_store_errors(self):
+        self.executor.shutdown()
+        path = os.path.join(self.tmpdir.name, "jobs.db")
+        job_store = _FlakyStore(path, "save", "pop_cancels")
+        self.executor = jobs.JobExecutor(1, store=job_store)
+        submitted = [self.executor.submit(i, _sleep, 0) for i in "ab"]
+        for job in submitted:
+            _wait(job)
+        self.assertEqual([job.state for job in submitted], [jobs.FINISHED] * 2)
+        # Also once saved
+        saved = lambda: [job_store.get(i).state for i in "ab"]
+        end = time.time() + 10
+        while saved() != [jobs.FINISHED] * 2 and time.time() < end:
+            time.sleep(0.05)
+        self.assertEqual(saved(), [jobs.FINISHED] * 2)
+
+    def test_interrupted(self):
+        self.executor.shutdown()
+        job_store = store.JobStore(os.path.join(self.tmpdir.name, "jobs.db"))
+        self.executor = jobs.JobExecutor(1, store=job_store)
+        _wait(self.executor.submit("a", _sleep, 10), jobs.RUNNING)
+        self.executor.submit("b", _sleep, 0)
+        self.executor.shutdown(wait=False)
+        for job_id in "ab":
+            job = job_store.get(job_id)
+            self.assertEqual((job.state, job.error), (jobs.FAILED, "Interrupted"))
+
+    def test_priority(self):
+        self.executor.shutdown()
+        self.executor = jobs.JobExecutor(1)
+        path = os.path.join(self.tmpdir.name, "order")
+        _wait(self.executor.submit("a", _sleep, 0.5), jobs.RUNNING)
+        low = self.executor.submit("b", _append, path, "b")
+        self.executor.submit("c", _append, path, "c", priority=1)
+        self.assertEqual(self.executor.ahead("b"), 1)
+        self.assertEqual(self.executor.ahead("c"), 0)
+        self.assertIsNone(self.executor.ahead("a"))
+        _wait(low)
+        with open(path) as f:
+            self.assertEqual(f.read(), "cb")
+
+    def test_cancel(self):
+        self.executor.shutdown()
+        self.executor = jobs.JobExecutor(1)
+        running = self.executor.submit("a", _sleep, 10)
+        _wait(running, jobs.RUNNING)
+        queued = self.executor.submit("b", _sleep, 10)
+        self.assertTrue(self.executor.cancel("b"))
+        self.assertEqual((queued.state, queued.error), (jobs.FAILED, jobs.CANCELLED))
+        self.assertTrue(self.executor.cancel("a"))
+        self.assertEqual(running.error, jobs.CANCELLED)
+        self.assertFalse(self.executor.cancel("a"))
+        # The worker killed is replaced
+        job = self.executor.submit("c", _sleep, 0)
+        _wait(job)
+        self.assertEqual(job.state, jobs.FINISHED)
+
+    def test_timeout(self):
+        job = self.executor.submit("a", _sleep, 10, timeout=0.2)
+        _wait(job)
+        self.assertEqual(job.state, jobs.FAILED)
+        self.assertIn("Timed out", job.error)
+        self.assertLess(job.finished - job.started, 5)
+
+    def test_cancel_other_process(self):
+        self.executor.shutdown()
+        path = os.path.join(self.tmpdir.name, "jobs.db")
+        self.executor = jobs.JobExecutor(1, store=store.JobStore(path))
+        _wait(self.executor.submit("a", _sleep, 10), jobs.RUNNING)
+        # E.g. another web worker, sharing the store
+        other = jobs.JobExecutor(1, store=store.JobStore(path))
+        self.assertTrue(other.cancel("a"))
+        self.assertFalse(other.cancel("b"))
+        job = other.get("a")
+        end = time.time() + 10
+        while not job.done and time.time() < end:
+            time.sleep(0.05)
+            job = other.get("a")
+        self.assertEqual((job.state, job.error), (jobs.FAILED, jobs.CANCELLED))
+
+    def test_leases(self):
+        self.executor.shutdown()
+        path = os.path.join(self.tmpdir.name, "jobs.db")
+        self.executor = jobs.JobExecutor(1, store=store.JobStore(path))
+        for name, value in (("LEASE", 0.6), ("CANCEL_POLL", 0.05)):
+            self.addCleanup(setattr, jobs, name, getattr(jobs, name))
+            setattr(jobs, name, value)
+        _wait(self.executor.submit("a", _sleep, 10), jobs.RUNNING)
+        other = jobs.JobExecutor(1, store=store.JobStore(path))
+        time.sleep(1.2)  # renewed meanwhile
+        self.assertEqual(other.get("a").state, jobs.RUNNING)
+        # E.g. a web worker crashed, no longer renewing them
+        self.executor._renew_leases = lambda: None
+        time.sleep(1.2)
+        job = other.get("a")
+        self.assertEqual((job.state, job.error), (jobs.FAILED, "Interrupted"))
+
+    def test_run_ids(self):
+        self.assertNotEqual(jobs.new_run_id(), jobs.new_run_id())
+
+
+if __name__ == "__main__":
+    unittest.main()
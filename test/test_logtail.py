@@ -0,0 +1,164 @@
+import glob
+import gzip
+import logging
+import os
+import tempfile
+import unittest
+
+from co2wui import logtail, runlog
+
+
+def _line(i, level="WARNING"):
+    return "2019-06-01 - co2mpas - %s - message %d\n" % (level, i)
+
+
+class TestLogTail(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "logfile.txt")
+
+    def _write(self, text):
+        with open(self.path, "a") as f:
+            f.write(text)
+
+    def test_missing(self):
+        self.assertEqual(logtail.read_lines(self.path, 10), ([], 10))
+        self.assertEqual(logtail.last_lines(self.path, 10), ([], 0))
+
+    def test_read_new_lines(self):
+        self._write(_line(0) + _line(1, "INFO") + "partial")
+        lines, offset = logtail.read_lines(self.path)
+        self.assertEqual(lines, [_line(0)])
+        self.assertEqual(offset, len(_line(0) + _line(1, "INFO")))
+
+        self._write(" line\n" + _line(2))
+        lines, offset = logtail.read_lines(self.path, offset)
+        self.assertEqual(lines, ["partial line\n", _line(2)])
+        self.assertEqual(offset, os.path.getsize(self.path))
+        self.assertEqual(logtail.read_lines(self.path, offset), ([], offset))
+
+    def test_read_limit(self):
+        self._write(_line(0) + _line(1))
+        lines, offset = logtail.read_lines(self.path, limit=len(_line(0)) + 3)
+        self.assertEqual(lines, [_line(0)])
+        self.assertEqual(logtail.read_lines(self.path, offset)[0], [_line(1)])
+
+    def test_last_lines(self):
+        text = "".join(_line(i, "INFO" if i % 2 else "ERROR") for i in range(100))
+        self._write(text + "partial")
+        for block in (7, 64, 1 << 16):
+            lines, offset = logtail.last_lines(self.path, 3, block=block)
+            self.assertEqual(lines, [_line(i, "ERROR") for i in (94, 96, 98)])
+            self.assertEqual(offset, len(text))
+
+    def test_last_lines_none(self):
+        self._write(_line(0) + _line(1) + "partial")
+        lines, offset = logtail.last_lines(self.path, 0, block=5)
+        self.assertEqual(lines, [])
+        self.assertEqual(offset, len(_line(0) + _line(1)))
+
+    def test_last_lines_whole_file(self):
+        self._write(_line(0) + _line(1))
+        lines, offset = logtail.last_lines(self.path, 10, block=5)
+        self.assertEqual(lines, [_line(0), _line(1)])
+
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.folder = self.tmpdir.name
+        self.handler = runlog.RunLogHandler()
+        self.addCleanup(self.handler.close)
+
+    def _log(self, *levels):
+        for i, level in enumerate(levels):
+            record = logging.LogRecord("co2mpas", level, "", 0, "m%d", (i,), None)
+            record.run = self.folder
+            self.handler.handle(record)
+
+    def test_missing(self):
+        self.assertEqual(logtail.read_records(self.folder, 9), ([], 9))
+        self.assertEqual(logtail.last_records(self.folder, 10), ([], 0))
+        self.assertEqual(logtail.level_counts(self.folder), {})
+
+    def test_read_records(self):
+        self._log(logging.INFO, logging.WARNING, logging.ERROR, logging.DEBUG)
+        records, offset = logtail.read_records(self.folder)
+        self.assertEqual([r["message"] for r in records], ["m1", "m2"])
+        self.assertEqual(offset, 4 * runlog.ENTRY.size)
+        records, _ = logtail.read_records(self.folder, level=logging.DEBUG)
+        self.assertEqual(len(records), 4)
+
+        # Only complete entries are read
+        limit = runlog.ENTRY.size * 2 + 3
+        records, offset = logtail.read_records(self.folder, 0, logging.INFO, limit)
+        self.assertEqual([r["message"] for r in records], ["m0", "m1"])
+        self.assertEqual(offset, 2 * runlog.ENTRY.size)
+
+    def test_last_records(self):
+        self._log(*[logging.ERROR, logging.INFO] * 50)
+        for block in (7, 64, 1 << 16):
+            records, offset = logtail.last_records(self.folder, 3, block=block)
+            self.assertEqual([r["message"] for r in records], ["m94", "m96", "m98"])
+            self.assertEqual(offset, 100 * runlog.ENTRY.size)
+
+    def test_compressed(self):
+        self._log(*[logging.ERROR, logging.INFO] * 5)
+        self.handler.close()
+        path = os.path.join(self.folder, runlog.LOGFILE)
+        with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+            dst.write(src.read())
+        os.remove(path)
+        records, _ = logtail.last_records(self.folder, 2)
+        self.assertEqual([r["message"] for r in records], ["m6", "m8"])
+
+        opened = []
+
+        def open_log(folder):
+            opened.append(folder)
+            return _open_log(folder)
+
+        _open_log, logtail._open_log = logtail._open_log, open_log
+        self.addCleanup(setattr, logtail, "_open_log", _open_log)
+        records = logtail.iter_records(self.folder, block=7)
+        self.assertEqual(
+            [r["message"] for r in records], ["m0", "m2", "m4", "m6", "m8"]
+        )
+        self.assertEqual(opened, [self.folder])
+
+    def test_iter_records(self):
+        self.assertEqual(list(logtail.iter_records(self.folder)), [])
+        self._log(logging.INFO, logging.WARNING, logging.DEBUG)
+        records = logtail.iter_records(self.folder, logging.DEBUG)
+        self.assertEqual([r["message"] for r in records], ["m0", "m1", "m2"])
+
+    def test_level_counts(self):
+        self._log(logging.INFO, logging.WARNING, logging.WARNING)
+        self.assertEqual(logtail.level_counts(self.folder), {"INFO": 1, "WARNING": 2})
+        # Of runs logged before they were counted
+        for path in glob.glob(os.path.join(self.folder, "log.*.levels")):
+            os.remove(path)
+        self.assertEqual(logtail.level_counts(self.folder), {"INFO": 1, "WARNING": 2})
+
+    def test_level_counts_delayed(self):
+        self._log(logging.INFO, logging.INFO, logging.WARNING, logging.DEBUG)
+        # The first one, those shown, then the others once in a while
+        self.assertEqual(logtail.level_counts(self.folder), {"INFO": 2, "WARNING": 1})
+        self.handler.close_run(self.folder)
+        self.assertEqual(
+            logtail.level_counts(self.folder), {"DEBUG": 1, "INFO": 2, "WARNING": 1}
+        )
+
+    def test_format_record(self):
+        self._log(logging.ERROR)
+        records, _ = logtail.read_records(self.folder)
+        self.assertRegex(
+            logtail.format_record(records[0]),
+            r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} - co2mpas - ERROR - m0\n$",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from co2wui import metrics
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter("runs_total", "Runs.", ["state"])
+        counter.inc(state="finished")
+        counter.inc(2, state="failed")
+        counter.inc(state="finished")
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP runs_total Runs.\n"
+            "# TYPE runs_total counter\n"
+            'runs_total{state="failed"} 2\n'
+            'runs_total{state="finished"} 2\n',
+        )
+        with self.assertRaises(ValueError):
+            counter.inc(route="/")
+
+    def test_gauge(self):
+        gauge = self.registry.gauge("streams", "Streams.")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        queued = [3]
+        self.registry.gauge("queued", "Queued.", fn=lambda: queued[0])
+        text = self.registry.render()
+        self.assertIn("\nstreams 1\n", text)
+        self.assertIn("\nqueued 3\n", text)
+
+    def test_process_labels(self):
+        pids = iter([1, 2])
+        registry = metrics.Registry({"worker": lambda: next(pids)})
+        registry.counter("runs_total", "Runs.", ["state"]).inc(state="failed")
+        registry.gauge("queued", "Queued.", fn=lambda: 3)
+        registry.histogram("wait", "Wait.", buckets=(1,)).observe(0.5)
+        lines = registry.render().splitlines()
+        for line in (
+            'runs_total{state="failed",worker="1"} 1',
+            'queued{worker="1"} 3',
+            'wait_bucket{worker="1",le="1"} 1',
+            'wait_sum{worker="1"} 0.5',
+        ):
+            self.assertIn(line, lines)
+        self.assertIn('runs_total{state="failed",worker="2"} 1', registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            "duration_seconds", "Durations.", ["route"], buckets=(0.1, 1)
+        )
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value, route='/a"b')
+        lines = self.registry.render().splitlines()[2:]
+        self.assertEqual(
+            lines,
+            [
+                'duration_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+                'duration_seconds_bucket{route="/a\\"b",le="1"} 3',
+                'duration_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+                'duration_seconds_sum{route="/a\\"b"} 6.25',
+                'duration_seconds_count{route="/a\\"b"} 4',
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import gzip
+import os
+import os.path as osp
+import tempfile
+import unittest
+
+from co2wui import jobs, retention, runlog, store
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.folder = osp.join(self.tmpdir.name, "output")
+        self.store = store.JobStore(osp.join(self.folder, "jobs.db"))
+        self.deleted = []
+
+    def _run(self, run_id, finished, size=1000):
+        folder = osp.join(self.folder, run_id)
+        os.makedirs(folder)
+        with open(osp.join(folder, "a.xlsx"), "wb") as f:
+            f.write(b"x" * size)
+        with open(osp.join(folder, runlog.LOGFILE), "wb") as f:
+            f.write(b'{"message": "calibrating"}\n' * 100)
+        job = jobs.Job(run_id)
+        job.state, job.finished = jobs.FINISHED, finished
+        self.store.add(job)
+        self.store.index_run(run_id, folder, ["a.xlsx"])
+
+    def _retention(self, **limits):
+        return retention.Retention(
+            self.store, self.folder, on_delete=self.deleted.extend, **limits
+        )
+
+    def _runs(self):
+        return sorted(run_id for run_id, _, _ in self.store.by_last_use())
+
+    def test_compress(self):
+        self._run("old", 100.0)
+        self._run("new", 990.0)
+        self._retention(compress_after=50).sweep(now=1000.0)
+        log = osp.join(self.folder, "old", runlog.LOGFILE)
+        self.assertFalse(osp.exists(log))
+        with gzip.open(log + ".gz") as f:
+            self.assertEqual(f.read(), b'{"message": "calibrating"}\n' * 100)
+        self.assertTrue(osp.isfile(osp.join(self.folder, "new", runlog.LOGFILE)))
+        self.assertEqual(self.deleted, [])
+
+    def test_max_age(self):
+        self._run("old", 100.0)
+        self._run("new", 990.0)
+        ret = self._retention(max_age=500)
+        ret.sweep(now=1000.0)
+        self.assertEqual(self.deleted, ["old"])
+        self.assertEqual(self._runs(), ["new"])
+        self.assertFalse(osp.exists(osp.join(self.folder, "old")))
+        self.assertEqual(ret.usage()["runs"], 1)
+
+    def test_quota_least_recently_used(self):
+        for i, run_id in enumerate("abc"):
+            self._run(run_id, 100.0 + i, size=10000)
+        self.store.touch("a")  # downloaded, hence kept
+        ret = self._retention(quota=26000)
+        ret.sweep(now=1000.0)
+        self.assertEqual(self.deleted, ["b"])
+        self.assertEqual(self._runs(), ["a", "c"])
+        usage = ret.usage()
+        self.assertLessEqual(usage["bytes"], 26000)
+        self.assertEqual(usage["quota"], 26000)
+
+    def test_delete(self):
+        self._run("a", 100.0)
+        self._run("b", 100.0)
+        ret = self._retention()
+        ret.sweep(now=1000.0)
+        freed = ret.delete(["a"])
+        self.assertGreater(freed, 1000)
+        self.assertEqual(self._runs(), ["b"])
+        self.assertIsNone(self.store.get("a"))
+        self.assertEqual(self.store.results_size(), 1000)
+        self.assertEqual(ret.usage()["runs"], 1)
+
+    def test_shared(self):
+        self._run("a", 100.0)
+        # E.g. another web worker, sharing the store
+        other = retention.Retention(
+            store.JobStore(self.store.path), self.folder, max_age=500
+        )
+        self.assertIsNone(other.usage()["checked"])
+        self.assertTrue(self.store.claim_sweep(3600, now=1000.0))
+        self.assertFalse(other.store.claim_sweep(3600, now=2000.0))
+        self._retention().sweep(now=1000.0)
+        self.assertEqual(other.usage()["runs"], 1)
+        self.assertEqual(other.usage()["checked"], 1000.0)
+        self.assertTrue(other.store.claim_sweep(3600, now=4600.0))
+
+    def test_on_usage(self):
+        self._run("a", 100.0)
+        self._run("b", 100.0)
+        reported = []
+        ret = retention.Retention(self.store, self.folder, on_usage=reported.append)
+        ret.sweep(now=1000.0)
+        ret.delete(["a"])
+        self.assertEqual([usage["runs"] for usage in reported], [2, 1])
+        # Checked in the background, swept or not
+        self.assertTrue(self.store.claim_sweep(3600))
+        ret.start(3600)
+        ret.stop()
+        self.assertEqual(len(reported), 3)
+
+    def test_on_sweep(self):
+        swept = []
+        ret = retention.Retention(self.store, self.folder, on_sweep=swept.append)
+        ret.sweep(now=1000.0)
+        ret.delete([])
+        self.assertEqual(swept, [1000.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from co2wui import logtail, runlog
+
+
+def _worker(folder, name):
+    # As in a worker process of the executor
+    app_log = os.path.join(folder, "app-%s.log" % name)
+    app_handler = logging.FileHandler(app_log)
+    app_handler.setLevel(logging.WARNING)
+    logging.getLogger().addHandler(app_handler)
+    runlog.install()
+
+    log = logging.getLogger("co2mpas.test")
+    log.warning("before the runs")
+    for run, level in (("a", "DEBUG"), ("b", "INFO")):
+        run_folder = os.path.join(folder, "%s-%s" % (name, run))
+        os.makedirs(run_folder)
+        runlog.start(run_folder, level, "test")
+        for i in range(100):
+            log.debug("%s %s %d", name, run, i)
+            log.info("%s %s %d", name, run, i)
+        runlog.end()
+    # As the parts of a split run, then another part in the same process
+    for i in range(2):
+        runlog.start(os.path.join(folder, "shared"), "INFO", "part")
+        log.info("%s part %d", name, i)
+        runlog.end()
+
+
+@unittest.skipUnless(
+    "fork" in multiprocessing.get_all_start_methods(), "needs forked workers"
+)
+class TestRunLog(unittest.TestCase):
+    def test_concurrent_runs(self):
+        ctx = multiprocessing.get_context("fork")
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, "shared"))
+            procs = [ctx.Process(target=_worker, args=(folder, name)) for name in "xy"]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join(10)
+                self.assertEqual(p.exitcode, 0)
+
+            for name in "xy":
+                for run, levels in (("a", ["DEBUG", "INFO"]), ("b", ["INFO"])):
+                    run_folder = os.path.join(folder, "%s-%s" % (name, run))
+                    records, _ = logtail.read_records(run_folder, level=logging.DEBUG)
+                    expected = [
+                        (level, "test", "%s %s %d" % (name, run, i))
+                        for i in range(100)
+                        for level in levels
+                    ]
+                    self.assertEqual(
+                        [(r["level"], r["stage"], r["message"]) for r in records],
+                        expected,
+                    )
+
+                self.assertEqual(
+                    logtail.level_counts(os.path.join(folder, "%s-a" % name)),
+                    {"DEBUG": 100, "INFO": 100},
+                )
+
+                # The handlers of the application keep their records
+                with open(os.path.join(folder, "app-%s.log" % name)) as f:
+                    self.assertEqual(f.read(), "before the runs\n")
+
+            shared = os.path.join(folder, "shared")
+            self.assertEqual(logtail.level_counts(shared), {"INFO": 4})
+
+
+if __name__ == "__main__":
+    unittest.main()
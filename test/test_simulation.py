@@ -0,0 +1,168 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from co2wui import cache, simulation
+
+
+def _summary(path, rows, info=True, **sheets):
+    # As written by co2mpas, with a level of the columns per header row
+    columns = pd.MultiIndex.from_tuples(
+        [("nedc_h", "prediction", "value", "co2_emission", "g/km")]
+    )
+    index = pd.MultiIndex.from_tuples(
+        [(vehicle, base) for vehicle, base, _ in rows], names=["id", "base"]
+    )
+    df = pd.DataFrame([[co2] for _, _, co2 in rows], index, columns)
+    with pd.ExcelWriter(path) as writer:
+        df.to_excel(excel_writer=writer, sheet_name="summary")
+        if info:
+            pd.DataFrame(
+                [("CO2MPAS version", "4.3.7")], columns=["Parameter", "Value"]
+            ).set_index("Parameter").to_excel(writer, sheet_name="proc_info")
+        for name, values in sheets.items():
+            pd.DataFrame(values).to_excel(
+                writer, sheet_name=name, header=False, index=False
+            )
+
+
+class _Dispatcher(object):
+    def __init__(self, **nodes):
+        self.nodes = nodes
+
+
+class _SubDispatch(object):
+    def __init__(self, dsp):
+        self.dsp = dsp
+
+
+class TestPrepare(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "a.xlsx")
+        with open(self.path, "wb") as f:
+            f.write(b"workbook")
+        self.calls = []
+
+        def parse_excel_file(input_file_name):
+            self.calls.append(input_file_name)
+            return {"data": 1}
+
+        def register_core():
+            # As co2mpas, building the core model afresh at each run
+            load = _Dispatcher(
+                parse_excel_file={"type": "function", "function": parse_excel_file}
+            )
+            return _Dispatcher(
+                load={"type": "dispatcher", "function": _SubDispatch(load)}
+            )
+
+        self.dsp = _Dispatcher(
+            register_core={"type": "function", "function": register_core},
+            core_model={"type": "data"},
+        )
+
+    def _parse(self):
+        core = self.dsp.nodes["register_core"]["function"]()
+        load = core.nodes["load"]["function"].dsp
+        return load.nodes["parse_excel_file"]["function"](self.path)
+
+    def test_core_parsers_memoized(self):
+        simulation._prepare(self.dsp, cache.ParsedInputs("4.1"))
+        simulation._prepare(self.dsp, cache.ParsedInputs("4.1"))  # only once
+        self.assertEqual(self._parse(), {"data": 1})
+        self.assertEqual(self._parse(), {"data": 1})
+        self.assertEqual(self.calls, [self.path])
+
+    def test_core_nodes_timed(self):
+        simulation._prepare(self.dsp, cache.ParsedInputs("4.1"))
+        simulation._profiler.start("run")
+        try:
+            self._parse()
+        finally:
+            profile = simulation._profiler.stop()
+        calls = {c["name"]: c["calls"] for c in profile["children"]}
+        self.assertEqual(calls, {"register_core": 1, "parse_excel_file": 1})
+
+
+class TestMergeSummaries(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def _read(self, path):
+        return {
+            name: df.values.tolist()
+            for name, df in pd.read_excel(path, sheet_name=None, header=None).items()
+        }
+
+    def test_parts(self):
+        _summary(self._path("1.xlsx"), [("v1", "a.xlsx", 150.0)])
+        # The same data, e.g. of a copy of an input file
+        _summary(self._path("2.xlsx"), [("v1", "a.xlsx", 150.0)], info=False)
+        _summary(
+            self._path("3.xlsx"),
+            [("v2", "b.xlsx", 120.0), ("v3", "c.xlsx", 130.0)],
+            notes=[["only here"], ["and here"]],
+        )
+        dst = self._path("merged.xlsx")
+        simulation.merge_summaries([self._path(n + ".xlsx") for n in "123"], dst)
+
+        merged = self._read(dst)
+        self.assertEqual(list(merged), ["summary", "proc_info", "notes"])
+        summary = merged["summary"]
+        self.assertEqual(len(summary), 6 + 4)
+        self.assertEqual(
+            [row[:3] for row in summary[6:]],
+            [
+                ["v1", "a.xlsx", 150],
+                ["v1", "a.xlsx", 150],
+                ["v2", "b.xlsx", 120],
+                ["v3", "c.xlsx", 130],
+            ],
+        )
+        self.assertEqual(
+            merged["proc_info"],
+            [
+                ["Parameter", "Value"],
+                ["CO2MPAS version", "4.3.7"],
+                ["CO2MPAS version", "4.3.7"],
+            ],
+        )
+        self.assertEqual(merged["notes"], [["only here"], ["and here"]])
+
+    def test_merge_parts(self):
+        run = self._path("run")
+        for i in range(2):
+            part = os.path.join(run, simulation.PARTS_FOLDER, str(i))
+            os.makedirs(part)
+            _summary(
+                os.path.join(part, "20190101-summary.xlsx"),
+                [("v%d" % i, "%d.xlsx" % i, 100.0 + i)],
+            )
+            with open(os.path.join(part, "v%d.xlsx" % i), "w") as f:
+                f.write("output")
+            with open(os.path.join(part, "result.dat"), "w") as f:
+                f.write("part %d" % i)
+        self.assertEqual(simulation._merge(run), [])
+
+        self.assertEqual(
+            sorted(os.listdir(run)),
+            ["20190101-summary.xlsx", "result.dat", "v0.xlsx", "v1.xlsx"],
+        )
+        summary = self._read(os.path.join(run, "20190101-summary.xlsx"))["summary"]
+        self.assertEqual(
+            [row[:2] for row in summary[6:]], [["v0", "0.xlsx"], ["v1", "1.xlsx"]]
+        )
+        with open(os.path.join(run, "result.dat")) as f:
+            self.assertEqual(f.read(), "part 0\npart 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import time
+import unittest
+
+from co2wui import jobs, store
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "output", "jobs.db")
+        self.store = store.JobStore(self.path)
+
+    def test_add_get_save(self):
+        self.assertIsNone(self.store.get("a"))
+        job = jobs.Job("a", {"tamode": "on"})
+        self.store.add(job)
+        with self.assertRaises(KeyError):
+            self.store.add(jobs.Job("a"))
+
+        job.state, job.started, job.finished = jobs.FAILED, 1.0, 2.0
+        job.error = "boom"
+        self.store.save(job)
+
+        stored = store.JobStore(self.path).get("a")
+        self.assertEqual(stored.flags, {"tamode": "on"})
+        self.assertEqual(
+            (stored.state, stored.submitted, stored.started, stored.finished),
+            (jobs.FAILED, job.submitted, 1.0, 2.0),
+        )
+        self.assertEqual(stored.error, "boom")
+
+    def test_interrupt(self):
+        for job_id, state in zip(
+            "abcd", (jobs.QUEUED, jobs.RUNNING, jobs.FINISHED, jobs.RUNNING)
+        ):
+            job = jobs.Job(job_id)
+            job.state = state
+            self.store.add(job)
+        self.assertEqual(self.store.count(jobs.QUEUED), 1)
+
+        # Of a database predating the leases, and of a process gone
+        self.store._db.execute("UPDATE jobs SET lease = NULL WHERE id = 'a'")
+        later = time.time() + jobs.LEASE
+        self.store.renew(["d"], later)
+        self.assertEqual(self.store.interrupt(later + 1), 2)
+        self.assertEqual(self.store.count(jobs.FAILED), 2)
+        self.assertEqual(self.store.get("b").error, "Interrupted")
+        self.assertEqual(self.store.get("c").state, jobs.FINISHED)
+        # Its lease renewed, still running
+        self.assertEqual(self.store.get("d").state, jobs.RUNNING)
+        self.assertEqual(self.store.interrupt(), 0)
+
+    def test_cancels(self):
+        for job_id, state in zip("abc", (jobs.QUEUED, jobs.RUNNING, jobs.FINISHED)):
+            job = jobs.Job(job_id)
+            job.state = state
+            self.store.add(job)
+        self.assertEqual([job.id for job in self.store.unfinished()], ["a", "b"])
+        self.assertTrue(self.store.request_cancel("b"))
+        self.assertTrue(self.store.request_cancel("b"))
+        self.assertFalse(self.store.request_cancel("c"))
+        self.assertFalse(self.store.request_cancel("d"))
+        self.assertEqual(self.store.pop_cancels(["a", "b"]), {"b"})
+        self.assertEqual(self.store.pop_cancels(["a", "b"]), set())
+
+
+class TestResultsCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.output = os.path.join(self.tmpdir.name, "output")
+        self.store = store.JobStore(os.path.join(self.output, "jobs.db"))
+
+    def _run(self, run_id, submitted, *files, **flags):
+        folder = os.path.join(self.output, run_id)
+        os.makedirs(folder)
+        for name in files:
+            with open(os.path.join(folder, name), "w") as f:
+                f.write(name)
+        job = jobs.Job(run_id, flags)
+        job.state, job.submitted = jobs.FINISHED, submitted
+        self.store.add(job)
+        return folder
+
+    def test_index_find(self):
+        folder = self._run("a", 1, "a.xlsx", tamode="on", only_summary="")
+        self.store.index_run("a", folder, ["a.xlsx"])
+        self._run("b", 2)
+        self.store.index_run("b", folder, [])
+        self._run("c", 3)  # not indexed
+
+        found = self.store.find()
+        self.assertEqual([job.id for job, files in found], ["b", "a"])
+        self.assertEqual([f[1:] for f in found[1][1]], [("a.xlsx", 6)])
+        file_id = found[1][1][0][0]
+        self.assertEqual(self.store.get_file(file_id), ("a", "a.xlsx", 6))
+        self.assertIsNone(self.store.get_file(file_id + 1))
+
+        find = lambda **kw: [job.id for job, files in self.store.find(**kw)]
+        self.assertEqual(find(descending=False), ["a", "b"])
+        self.assertEqual(find(limit=1, offset=1), ["a"])
+        self.assertEqual(find(since=2), ["b"])
+        self.assertEqual(find(until=2), ["a"])
+        self.assertEqual(find(flags=["tamode"]), ["a"])
+        self.assertEqual(find(flags=["only_summary"]), [])
+        self.assertEqual(find(state=jobs.FAILED), [])
+        with self.assertRaises(ValueError):
+            self.store.find(sort="flags; DROP TABLE jobs")
+
+    def test_sync(self):
+        self._run("a", 1, "a.xlsx")
+        os.makedirs(os.path.join(self.output, "12345"))
+        listed = []
+
+        def listdir(folder):
+            listed.append(os.path.basename(folder))
+            return [f for f in os.listdir(folder) if f.endswith(".xlsx")]
+
+        self.store.sync(self.output, listdir)
+        self.assertEqual(sorted(listed), ["12345", "a"])
+        self.assertEqual(self.store.get("12345").state, jobs.FINISHED)
+        self.assertEqual(len(self.store.find()), 2)
+
+        self.store.sync(self.output, listdir)
+        self.assertEqual(len(listed), 2)
+
+    def test_last_use_delete(self):
+        for run_id in "abc":
+            folder = self._run(run_id, 1, "%s.xlsx" % run_id)
+            self.store.index_run(run_id, folder, ["%s.xlsx" % run_id])
+        self.store.touch("a")
+        self.assertEqual([r[0] for r in self.store.by_last_use()], ["b", "c", "a"])
+
+        self.store.delete(["a", "b"])
+        self.assertEqual([r[0] for r in self.store.by_last_use()], ["c"])
+        self.assertIsNone(self.store.get("a"))
+        self.assertEqual([job.id for job, files in self.store.find()], ["c"])
+        self.assertEqual(self.store.results_size(), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
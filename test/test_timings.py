@@ -0,0 +1,88 @@
+import threading
+import unittest
+
+from co2wui import timings
+
+
+class _Dispatcher(object):
+    def __init__(self, **nodes):
+        self.nodes = nodes
+
+
+class _SubDispatch(object):
+    def __init__(self, dsp):
+        self.dsp = dsp
+
+    def __call__(self, x):
+        return self.dsp.nodes["inner"]["function"](x)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = timings.Profiler()
+        inner = _Dispatcher(inner={"type": "function", "function": lambda x: x + 1})
+        self.sub = _SubDispatch(inner)
+        self.dsp = _Dispatcher(
+            f={"type": "function", "function": lambda x: x * 2},
+            sub={"type": "dispatcher", "function": self.sub},
+            data={"type": "data"},
+        )
+        timings.instrument(self.dsp, self.profiler)
+
+    def _call(self, node, x):
+        return self.dsp.nodes[node]["function"](x)
+
+    def test_inactive(self):
+        self.assertEqual(self._call("f", 2), 4)
+        self.assertIsNone(self.profiler.root)
+
+    def test_call_tree(self):
+        self.assertIsInstance(self.dsp.nodes["sub"]["function"], _SubDispatch)
+        timings.instrument(self.dsp, self.profiler)  # only once
+
+        self.profiler.start("run")
+        with self.profiler.timed("simulation"):
+            self.assertEqual(self._call("f", 2), 4)
+            self.assertEqual(self._call("sub", 2), 3)
+            self.assertEqual(self._call("sub", 3), 4)
+        profile = self.profiler.stop()
+
+        self.assertEqual(profile["name"], "run")
+        (simulation,) = profile["children"]
+        self.assertEqual(
+            [(c["name"], c["calls"]) for c in simulation["children"]],
+            [("f", 1), ("sub", 2)],
+        )
+        (inner,) = simulation["children"][1]["children"]
+        self.assertEqual((inner["name"], inner["calls"]), ("inner", 2))
+        self.assertGreaterEqual(profile["wall"], simulation["wall"])
+
+    def test_threads(self):
+        self.profiler.start("run")
+        with self.profiler.timed("simulation"):
+            thread = threading.Thread(target=self._call, args=("f", 1))
+            thread.start()
+            thread.join()
+        profile = self.profiler.stop()
+        (simulation,) = profile["children"]
+        self.assertEqual([c["name"] for c in simulation["children"]], ["f"])
+
+    def test_hotspots(self):
+        profile = {
+            "name": "run",
+            "calls": 1,
+            "wall": 10.0,
+            "cpu": 9.0,
+            "children": [
+                {"name": "a", "calls": 3, "wall": 6.0, "cpu": 6.0, "children": []},
+                {"name": "b", "calls": 1, "wall": 1.0, "cpu": 1.0, "children": []},
+            ],
+        }
+        rows = timings.hotspots(profile, 2)
+        self.assertEqual(
+            rows, [(("run", "a"), 3, 6.0, 6.0, 6.0), (("run",), 1, 10.0, 3.0, 9.0)]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
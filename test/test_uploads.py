@@ -0,0 +1,104 @@
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+from co2wui import cache, uploads
+
+
+class TestUploads(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.inputs = os.path.join(self.tmpdir.name, "input")
+        os.makedirs(self.inputs)
+        self.uploads = self._uploads()
+
+    def _uploads(self):
+        folder = os.path.join(self.tmpdir.name, "uploads")
+        return uploads.Uploads(folder, self.inputs, 100)
+
+    def _read(self, name):
+        with open(os.path.join(self.inputs, name), "rb") as f:
+            return f.read()
+
+    def test_chunks(self):
+        data = b"0123456789" * 5
+        digest = hashlib.sha256(data).hexdigest()
+        upload_id, offset, done = self.uploads.start("a.xlsx", len(data), digest)
+        self.assertEqual((offset, done), (0, False))
+        self.assertEqual(
+            self.uploads.write(upload_id, 0, io.BytesIO(data[:20])), (20, False)
+        )
+        self.assertEqual(
+            self.uploads.write(upload_id, 20, io.BytesIO(data[20:])), (50, True)
+        )
+        self.assertEqual(self._read("a.xlsx"), data)
+        path = os.path.join(self.inputs, "a.xlsx")
+        self.assertEqual(cache.known_digest(path), digest)
+
+    def test_resume(self):
+        data = os.urandom(60)
+        upload_id = self.uploads.start("a.xlsx", 60, modified="1")[0]
+        self.uploads.write(upload_id, 0, io.BytesIO(data[:25]))
+
+        # After a restart, the same file resumes from what was received
+        self.uploads = self._uploads()
+        self.assertEqual(
+            self.uploads.start("a.xlsx", 60, modified="1"), (upload_id, 25, False)
+        )
+        with self.assertRaises(uploads.UploadError) as cm:
+            self.uploads.write(upload_id, 10, io.BytesIO(data[10:]))
+        self.assertEqual(cm.exception.status, 409)
+        self.uploads.write(upload_id, 25, io.BytesIO(data[25:]))
+        self.assertEqual(self._read("a.xlsx"), data)
+        path = os.path.join(self.inputs, "a.xlsx")
+        self.assertEqual(cache.known_digest(path), hashlib.sha256(data).hexdigest())
+
+    def test_corrupted(self):
+        upload_id = self.uploads.start("a.xlsx", 4, "00" * 32)[0]
+        with self.assertRaises(uploads.UploadError) as cm:
+            self.uploads.write(upload_id, 0, io.BytesIO(b"data"))
+        self.assertEqual(cm.exception.status, 422)
+        self.assertEqual(os.listdir(self.inputs), [])
+
+    def test_max_size(self):
+        with self.assertRaises(uploads.UploadError) as cm:
+            self.uploads.start("a.xlsx", 101)
+        self.assertEqual(cm.exception.status, 413)
+        with self.assertRaises(uploads.UploadError) as cm:
+            self.uploads.save("a.xlsx", io.BytesIO(b"x" * 101))
+        self.assertEqual(cm.exception.status, 413)
+        self.assertEqual(os.listdir(self.inputs), [])
+
+    def test_check_form(self):
+        self.uploads.check_form(100 + uploads.FORM_OVERHEAD)
+        for length, status in ((None, 411), (101 + uploads.FORM_OVERHEAD, 413)):
+            with self.assertRaises(uploads.UploadError) as cm:
+                self.uploads.check_form(length)
+            self.assertEqual(cm.exception.status, status)
+
+    def test_sweep(self):
+        stale = self.uploads.start("a.xlsx", 10)[0]
+        self.uploads.write(stale, 0, io.BytesIO(b"data"))
+        fresh = self.uploads.start("b.xlsx", 10)[0]
+        folder = self.uploads.folder
+        for name in os.listdir(folder):
+            if name.startswith(stale):
+                os.utime(os.path.join(folder, name), (1000.0, 1000.0))
+        self.assertEqual(self.uploads.sweep(3600, now=5000.0), [stale])
+        self.assertEqual(sorted(os.listdir(folder)), [fresh + ".json", fresh + ".part"])
+        with self.assertRaises(uploads.UploadError):
+            self.uploads.offset(stale)
+        self.assertEqual(self.uploads.sweep(3600), [])
+
+    def test_save(self):
+        self.uploads.save("a.xlsx", io.BytesIO(b"data"))
+        self.uploads.save("b.xlsx", io.BytesIO(b""))
+        self.assertEqual(self._read("a.xlsx"), b"data")
+        self.assertEqual(self._read("b.xlsx"), b"")
+
+
+if __name__ == "__main__":
+    unittest.main()